@@ -29,6 +29,36 @@
 
 import sys
 
+import os
+
+import importlib.util
+
+def nothing_to_do(argv):
+	"""
+	Checks the state stamp before importing the rest of rpm_divert, so
+	that no-op apply and unapply requests cost little more than the
+	interpreter startup.
+
+	:param: argv: the command line arguments
+	:returns: True if the request would change nothing.
+	"""
+
+	try:
+		package = importlib.util.find_spec("rpm_divert")
+		spec = importlib.util.spec_from_file_location(
+			"_rpm_divert_stamp",
+			os.path.join(package.submodule_search_locations[0], "stamp.py")
+		)
+		stamp = importlib.util.module_from_spec(spec)
+		spec.loader.exec_module(stamp)
+	except Exception:
+		return False
+
+	return stamp.nothing_to_do(argv)
+
+if __name__ == "__main__" and nothing_to_do(sys.argv[1:]):
+	sys.exit(0)
+
 import logging
 
 import rpm_divert.commands as commands
@@ -42,9 +72,6 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger()
 
 if __name__ == "__main__":
-	db = Database()
-	db.load()
-
 	# Generate argument parser
 	parser = generate_arguments(
 		[
@@ -53,6 +80,27 @@ if __name__ == "__main__":
 		]
 	)
 
+	parser.add_argument(
+		"--root",
+		type=str,
+		default=None,
+		help="operate on the root filesystem at ROOT (e.g. a mounted image tree) instead of the running system"
+	)
+
+	parser.add_argument(
+		"--layer",
+		type=str,
+		action="append",
+		default=[],
+		help="stack the read-only diversion database at LAYER below the writable one (can be repeated, the last one wins)"
+	)
+
+	parser.add_argument(
+		"--compact",
+		action="store_true",
+		help="save the diversion database without indentation"
+	)
+
 	args = parser.parse_args()
 
 	command = args.command
@@ -62,9 +110,20 @@ if __name__ == "__main__":
 		parser.parse_args(["-h"])
 		sys.exit(0) # Never called
 
+	# Deferred requests only touch the pending queue, fleet saves the
+	# database of every root on its own and diff reads its own databases.
+	read_only = command in ("list", "fleet", "diff", "check", "export-script") or getattr(args, "defer", False)
+
+	db = Database.open(
+		mode="r" if read_only else "rw",
+		root=vars(args).pop("root"),
+		layers=vars(args).pop("layer"),
+		compact=vars(args).pop("compact")
+	)
+
 	try:
 		commands.route_from_namespace(args, context_dict={"database" : db})
 	finally:
-		# Save
-		if command != "list":
-			db.save()
+		# Save what has been done so far, even on failure
+		db.commit()
+		db.close()
@@ -29,3 +29,5 @@
 from .diversion import *
 from .database import *
 from .package import *
+from .pending import *
+from .journal import *
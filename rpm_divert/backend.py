@@ -0,0 +1,555 @@
+# -*- coding: utf-8 -*-
+#
+# rpm-divert
+# Copyright (C) 2018 Eugenio "g7" Paolantonio
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of the <organization> nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Filesystem backends.
+
+Diversions never touch the filesystem directly: every query and every
+journal step goes through a backend. OSBackend is the real filesystem,
+MemoryBackend an in-memory tree that counts the operations, to test and
+benchmark the planning and database logic at scale without any disk I/O:
+
+	from rpm_divert import Diversion, Journal
+	from rpm_divert.backend import MemoryBackend
+
+	fs = MemoryBackend()
+	fs.add_file("/usr/bin/hello", b"hello")
+
+	diversion = Diversion("/usr/bin/hello", "/usr/bin/hello-diverted", "nothing", None)
+	diversion.apply(journal=Journal(None, backend=fs))
+
+	assert fs.counts["rename"] == 1
+"""
+
+import collections
+
+import errno
+
+import functools
+
+import os
+
+import shutil
+
+import stat
+
+from types import SimpleNamespace
+
+from rpm_divert import fileutil
+
+from rpm_divert.rootfs import resolve
+
+__all__ = [
+	"OSBackend",
+	"MemoryBackend",
+	"OS_BACKEND"
+]
+
+MAX_SYMLINKS = 40
+
+class OSBackend:
+
+	"""
+	The host filesystem.
+	"""
+
+	# Queries
+	lexists = staticmethod(os.path.lexists)
+	exists = staticmethod(os.path.exists)
+	isdir = staticmethod(os.path.isdir)
+	islink = staticmethod(os.path.islink)
+	readlink = staticmethod(os.readlink)
+	lstat = staticmethod(os.lstat)
+	listdir = staticmethod(os.listdir)
+	same_content = staticmethod(fileutil.same_content)
+	same_tree = staticmethod(fileutil.same_tree)
+	supports_renameat2 = staticmethod(fileutil.supports_renameat2)
+
+	# Journal steps
+	makedirs = staticmethod(os.makedirs)
+	rename = staticmethod(os.rename)
+	rename_noreplace = staticmethod(fileutil.rename_noreplace)
+	exchange = staticmethod(fileutil.exchange)
+	symlink = staticmethod(os.symlink)
+	copy = staticmethod(fileutil.copy)
+	copytree = staticmethod(fileutil.copytree)
+	copymode = staticmethod(shutil.copymode)
+	remove = staticmethod(os.remove)
+	rmtree = staticmethod(shutil.rmtree)
+
+	def resolve(self, root, path, follow=True):
+		"""
+		Resolves a path inside the given root, see rootfs.resolve().
+		"""
+
+		return resolve(root, path, follow=follow, backend=self)
+
+# Used when no backend has been supplied
+OS_BACKEND = OSBackend()
+
+def _counted(function):
+	"""
+	Counts the calls of a MemoryBackend() method.
+	"""
+
+	@functools.wraps(function)
+	def wrapper(self, *args, **kwargs):
+		self.counts[function.__name__] += 1
+
+		return function(self, *args, **kwargs)
+
+	return wrapper
+
+def _error(code, path):
+	"""
+	:returns: an OSError() for the given errno and path
+	"""
+
+	return OSError(code, os.strerror(code), path)
+
+class MemoryBackend:
+
+	"""
+	An in-memory filesystem, counting every operation in self.counts.
+
+	Paths are absolute and normalised, symlinks are only followed when
+	they are the last component.
+	"""
+
+	def __init__(self, renameat2=True):
+		"""
+		Initialises the class.
+
+		:param: renameat2: whether supports_renameat2() answers True.
+		Defaults to True.
+		"""
+
+		self.renameat2 = renameat2
+
+		self.counts = collections.Counter()
+
+		# path -> SimpleNamespace(st_mode, st_ino, st_size, st_mtime_ns,
+		# data), where data is the content of files and the target of
+		# symlinks
+		self._nodes = {}
+		# directory -> set of entry names
+		self._children = {}
+
+		self._inode = 0
+		self._clock = 0
+
+		self._create("/", stat.S_IFDIR | 0o755)
+
+	def _create(self, path, mode, data=None):
+		"""
+		Creates a node. Its parent directory must exist, and the path
+		must not.
+
+		:param: path: the normalised path
+		:param: mode: the st_mode, file type included
+		:param: data: the file content or the symlink target
+		:returns: the node
+		"""
+
+		if path in self._nodes:
+			raise _error(errno.EEXIST, path)
+
+		parent, name = os.path.split(path)
+		if path != "/":
+			if not parent in self._children:
+				raise _error(errno.ENOENT if not parent in self._nodes else errno.ENOTDIR, path)
+			self._children[parent].add(name)
+
+		self._inode += 1
+		self._clock += 1
+
+		node = SimpleNamespace(
+			st_mode=mode,
+			st_ino=self._inode,
+			st_size=len(data) if data is not None else 0,
+			st_mtime_ns=self._clock,
+			data=data
+		)
+
+		self._nodes[path] = node
+		if stat.S_ISDIR(mode):
+			self._children[path] = set()
+
+		return node
+
+	def _walk(self, path):
+		"""
+		:param: path: the normalised path of a node
+		:returns: the paths of the node and of every node below it,
+		parents first
+		"""
+
+		paths = [path]
+
+		for current in paths:
+			for name in self._children.get(current, ()):
+				paths.append(os.path.join(current, name))
+
+		return paths
+
+	def _detach(self, path):
+		"""
+		Removes a node, and everything below it.
+
+		:param: path: the normalised path
+		:returns: a dictionary of path suffix ("" for the node itself) ->
+		node of what has been removed
+		"""
+
+		parent, name = os.path.split(path)
+		self._children[parent].discard(name)
+
+		detached = {}
+		for current in self._walk(path):
+			detached[current[len(path):]] = self._nodes.pop(current)
+			self._children.pop(current, None)
+
+		return detached
+
+	def _attach(self, path, detached):
+		"""
+		Puts back nodes removed by _detach(), at a new path.
+
+		:param: path: the normalised path
+		:param: detached: the dictionary returned by _detach()
+		"""
+
+		parent, name = os.path.split(path)
+		self._children[parent].add(name)
+
+		for suffix, node in detached.items():
+			current = path + suffix
+			self._nodes[current] = node
+			if stat.S_ISDIR(node.st_mode):
+				self._children[current] = set()
+
+			if current != path:
+				self._children[os.path.dirname(current)].add(os.path.basename(current))
+
+	def _lookup(self, path, follow=True):
+		"""
+		:param: path: the path
+		:param: follow: if True, follows the last component if it is a
+		symlink
+		:returns: a (normalised path, node) tuple. node is None if the
+		path doesn't exist.
+		"""
+
+		path = os.path.normpath(path)
+
+		for _ in range(MAX_SYMLINKS):
+			node = self._nodes.get(path)
+
+			if not follow or node is None or not stat.S_ISLNK(node.st_mode):
+				return path, node
+
+			path = os.path.normpath(os.path.join(os.path.dirname(path), node.data))
+
+		raise _error(errno.ELOOP, path)
+
+	def _existing(self, path, follow=True):
+		"""
+		:returns: the (normalised path, node) tuple of an existing path
+		"""
+
+		path, node = self._lookup(path, follow=follow)
+
+		if node is None:
+			raise _error(errno.ENOENT, path)
+
+		return path, node
+
+	# Setup helpers, not counted
+
+	def add_directory(self, path, mode=0o755):
+		"""
+		Creates a directory, and its missing parents.
+
+		:param: path: the absolute path
+		:param: mode: the permission bits. Defaults to 0o755.
+		"""
+
+		path = os.path.normpath(path)
+
+		if not path in self._nodes:
+			self.add_directory(os.path.dirname(path))
+			self._create(path, stat.S_IFDIR | mode)
+
+	def add_file(self, path, data=b"", mode=0o644):
+		"""
+		Creates (or replaces) a file, and its missing parent directories.
+
+		:param: path: the absolute path
+		:param: data: the content, as bytes. Defaults to b"".
+		:param: mode: the permission bits. Defaults to 0o644.
+		"""
+
+		path = os.path.normpath(path)
+
+		self.add_directory(os.path.dirname(path))
+		if path in self._nodes:
+			self._detach(path)
+		self._create(path, stat.S_IFREG | mode, bytes(data))
+
+	def add_symlink(self, target, path):
+		"""
+		Creates a symlink, and its missing parent directories.
+
+		:param: target: the link target
+		:param: path: the absolute path
+		"""
+
+		path = os.path.normpath(path)
+
+		self.add_directory(os.path.dirname(path))
+		self._create(path, stat.S_IFLNK | 0o777, target)
+
+	def read(self, path):
+		"""
+		:param: path: a file path, symlinks are followed
+		:returns: the file content
+		"""
+
+		return self._existing(path)[1].data
+
+	# Queries
+
+	@_counted
+	def lexists(self, path):
+		return self._lookup(path, follow=False)[1] is not None
+
+	@_counted
+	def exists(self, path):
+		try:
+			return self._lookup(path)[1] is not None
+		except OSError:
+			return False
+
+	@_counted
+	def isdir(self, path):
+		try:
+			node = self._lookup(path)[1]
+		except OSError:
+			return False
+
+		return node is not None and stat.S_ISDIR(node.st_mode)
+
+	@_counted
+	def islink(self, path):
+		node = self._lookup(path, follow=False)[1]
+
+		return node is not None and stat.S_ISLNK(node.st_mode)
+
+	@_counted
+	def readlink(self, path):
+		path, node = self._existing(path, follow=False)
+
+		if not stat.S_ISLNK(node.st_mode):
+			raise _error(errno.EINVAL, path)
+
+		return node.data
+
+	@_counted
+	def lstat(self, path):
+		return self._existing(path, follow=False)[1]
+
+	@_counted
+	def listdir(self, path):
+		path, node = self._existing(path)
+
+		if not stat.S_ISDIR(node.st_mode):
+			raise _error(errno.ENOTDIR, path)
+
+		return sorted(self._children[path])
+
+	@_counted
+	def same_content(self, a, b):
+		try:
+			a_node = self._lookup(a)[1]
+			b_node = self._lookup(b)[1]
+		except OSError:
+			return False
+
+		return (
+			a_node is not None and b_node is not None and
+			stat.S_ISREG(a_node.st_mode) and stat.S_ISREG(b_node.st_mode) and
+			a_node.data == b_node.data
+		)
+
+	@_counted
+	def same_tree(self, a, b):
+		a, a_node = self._lookup(a)
+		b, b_node = self._lookup(b)
+
+		if not (
+			a_node is not None and b_node is not None and
+			stat.S_ISDIR(a_node.st_mode) and stat.S_ISDIR(b_node.st_mode)
+		):
+			return False
+
+		a_tree = {
+			os.path.relpath(path, a) : (stat.S_IFMT(self._nodes[path].st_mode), self._nodes[path].data)
+			for path in self._walk(a)
+		}
+		b_tree = {
+			os.path.relpath(path, b) : (stat.S_IFMT(self._nodes[path].st_mode), self._nodes[path].data)
+			for path in self._walk(b)
+		}
+
+		return a_tree == b_tree
+
+	@_counted
+	def supports_renameat2(self, directory):
+		return self.renameat2
+
+	def resolve(self, root, path, follow=True):
+		"""
+		Resolves a path inside the given root, see rootfs.resolve().
+		"""
+
+		return resolve(root, path, follow=follow, backend=self)
+
+	# Journal steps
+
+	@_counted
+	def makedirs(self, path):
+		path = os.path.normpath(path)
+
+		if path in self._nodes:
+			raise _error(errno.EEXIST, path)
+
+		self.add_directory(path)
+
+	def _rename(self, src, dst, replace=True):
+		src, src_node = self._existing(src, follow=False)
+		dst, dst_node = self._lookup(dst, follow=False)
+
+		if dst_node is not None:
+			if not replace:
+				raise _error(errno.EEXIST, dst)
+			elif stat.S_ISDIR(dst_node.st_mode) != stat.S_ISDIR(src_node.st_mode):
+				raise _error(errno.EISDIR if stat.S_ISDIR(dst_node.st_mode) else errno.ENOTDIR, dst)
+			elif self._children.get(dst):
+				raise _error(errno.ENOTEMPTY, dst)
+
+			self._detach(dst)
+
+		if not os.path.dirname(dst) in self._children:
+			raise _error(errno.ENOENT, dst)
+
+		self._attach(dst, self._detach(src))
+
+	@_counted
+	def rename(self, src, dst):
+		self._rename(src, dst)
+
+	@_counted
+	def rename_noreplace(self, src, dst):
+		self._rename(src, dst, replace=False)
+
+	@_counted
+	def exchange(self, a, b, ino=None):
+		a = self._existing(a, follow=False)[0]
+		b = self._existing(b, follow=False)[0]
+
+		a_nodes = self._detach(a)
+		b_nodes = self._detach(b)
+		self._attach(a, b_nodes)
+		self._attach(b, a_nodes)
+
+	@_counted
+	def symlink(self, target, path):
+		self._create(os.path.normpath(path), stat.S_IFLNK | 0o777, target)
+
+	@_counted
+	def copy(self, src, dst, throttle=None):
+		src_node = self._existing(src)[1]
+		dst, dst_node = self._lookup(dst)
+
+		if dst_node is not None and stat.S_ISDIR(dst_node.st_mode):
+			dst = os.path.join(dst, os.path.basename(src))
+			dst_node = self._nodes.get(dst)
+
+		if dst_node is not None and stat.S_ISREG(dst_node.st_mode) and dst_node.data == src_node.data:
+			# Like fileutil.copy(), only the metadata is copied
+			dst_node.st_mode = src_node.st_mode
+			dst_node.st_mtime_ns = src_node.st_mtime_ns
+			return
+		elif dst_node is not None:
+			self._detach(dst)
+
+		node = self._create(dst, src_node.st_mode, src_node.data)
+		node.st_mtime_ns = src_node.st_mtime_ns
+
+		if throttle is not None:
+			throttle.transfer(node.st_size)
+
+	@_counted
+	def copytree(self, src, dst, throttle=None):
+		src = self._existing(src)[0]
+		dst = os.path.normpath(dst)
+
+		for path in self._walk(src):
+			node = self._nodes[path]
+			target = os.path.normpath(os.path.join(dst, os.path.relpath(path, src)))
+
+			copied = self._create(target, node.st_mode, node.data)
+			copied.st_mtime_ns = node.st_mtime_ns
+
+			if throttle is not None and stat.S_ISREG(node.st_mode):
+				throttle.transfer(node.st_size)
+
+	@_counted
+	def copymode(self, src, dst):
+		src_node = self._existing(src)[1]
+		dst_node = self._existing(dst)[1]
+
+		dst_node.st_mode = stat.S_IFMT(dst_node.st_mode) | stat.S_IMODE(src_node.st_mode)
+
+	@_counted
+	def remove(self, path):
+		path, node = self._existing(path, follow=False)
+
+		if stat.S_ISDIR(node.st_mode):
+			raise _error(errno.EISDIR, path)
+
+		self._detach(path)
+
+	@_counted
+	def rmtree(self, path):
+		path, node = self._existing(path, follow=False)
+
+		if not stat.S_ISDIR(node.st_mode):
+			raise _error(errno.ENOTDIR, path)
+
+		self._detach(path)
@@ -31,7 +31,15 @@ COMMANDS = [
 	"remove",
 	"apply",
 	"unapply",
-	"list"
+	"list",
+	"flush",
+	"reconcile",
+	"fleet",
+	"diff",
+	"merge",
+	"check",
+	"export_script",
+	"import_status"
 ]
 
 from .add import *
@@ -39,6 +47,14 @@ from .remove import *
 from .apply import *
 from .unapply import *
 from .list import *
+from .flush import *
+from .reconcile import *
+from .fleet import *
+from .diff import *
+from .merge import *
+from .check import *
+from .export_script import *
+from .import_status import *
 
 def route_from_namespace(namespace, context_dict={}):
 	"""
@@ -51,7 +67,7 @@ def route_from_namespace(namespace, context_dict={}):
 
 	namespace = vars(namespace)
 	namespace.update(context_dict)
-	command = namespace.pop("command")
+	command = namespace.pop("command").replace("-", "_")
 
 	if not command in COMMANDS:
 		raise Exception("Command %s not found" % command)
@@ -28,8 +28,6 @@
 
 from .base import command
 
-from rpm_divert import Package, Diversion
-
 __all__ = [
 	"add"
 ]
@@ -78,16 +76,22 @@ __all__ = [
 				"default" : None,
 				"help" : "The replacement file to symlink to source. Used only if --action=symlink"
 			}
+		),
+		(
+			"kind",
+			{
+				"arguments" : ["--kind", "-k"],
+				"type" : str,
+				"choices" : ["file", "directory", "pattern"],
+				"default" : "file",
+				"help" : "The kind of source: 'directory' diverts the whole tree with a single rename, 'pattern' diverts every file matching the source pattern (with '{name}' in diversion and replacement replaced by the file name). Defaults to 'file'"
+			}
 		)
 	]
 )
-def add(database=None, package=None, source=None, diversion=None, action=None, replacement=None):
+def add(database=None, package=None, source=None, diversion=None, action=None, replacement=None, kind=None):
 	"""
 	Adds a diversion.
 	"""
 
-	# FIXME: check for the diversion source globally to avoid conflicts
-	# between packages diverting the same file
-
-	diversion = Diversion(source, diversion, action=action, replacement=replacement)
-	database[package].diversions.add(diversion)
+	database.add(package, source, diversion, action=action, replacement=replacement, kind=kind)
@@ -26,12 +26,20 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import logging
+
 from .base import command
 
+from rpm_divert.events import EVENT_FORMATS, create_observer
+
+from rpm_divert.throttle import Throttle, set_idle_priority
+
 __all__ = [
 	"apply"
 ]
 
+logger = logging.getLogger(__name__)
+
 @command(
 	help="applies the diversions",
 	args=[
@@ -58,22 +66,74 @@ __all__ = [
 				"action" : "store_true",
 				"help" : "if specified, creates the diversion directory if it doesn't exist."
 			}
+		),
+		(
+			"defer",
+			{
+				"arguments" : ["--defer"],
+				"action" : "store_true",
+				"help" : "if specified, queues the request until the next flush instead of applying it right away."
+			}
+		),
+		(
+			"max-bytes-per-sec",
+			{
+				"arguments" : ["--max-bytes-per-sec"],
+				"type" : int,
+				"help" : "the maximum number of bytes copied per second by copy diversions."
+			}
+		),
+		(
+			"max-ops-per-sec",
+			{
+				"arguments" : ["--max-ops-per-sec"],
+				"type" : int,
+				"help" : "the maximum number of other filesystem steps (renames, symlinks...) per second."
+			}
+		),
+		(
+			"idle",
+			{
+				"arguments" : ["--idle"],
+				"action" : "store_true",
+				"help" : "if specified, runs in the idle I/O scheduling class."
+			}
+		),
+		(
+			"progress",
+			{
+				"arguments" : ["--progress"],
+				"action" : "store_true",
+				"help" : "if specified, shows the progress on stderr."
+			}
+		),
+		(
+			"events",
+			{
+				"arguments" : ["--events"],
+				"choices" : EVENT_FORMATS,
+				"help" : "writes the progress events to stdout, in the given format."
+			}
 		)
 	]
 )
-def apply(database=None, source=None, package=None, create_directory=False):
+def apply(database=None, source=None, package=None, create_directory=False, defer=False, max_bytes_per_sec=None, max_ops_per_sec=None, idle=False, progress=False, events=None):
 
-	for diversion in (
-		div
-		for div in (
-			[
-				div
-				for pkg in database
-				for div in database[pkg].diversions
-			]
-			if package is None
-			else database[package].diversions
-		)
-		if source is None or div.source == source
-	):
-		diversion.apply(create_directory=create_directory)
+	if defer:
+		database.pending.append("apply", package=package, source=source, create_directory=create_directory)
+		return
+
+	if idle and not set_idle_priority():
+		logger.warning("unable to set the idle I/O priority, lowered the CPU priority instead")
+
+	throttle = Throttle(max_bytes_per_sec=max_bytes_per_sec, max_ops_per_sec=max_ops_per_sec)
+
+	database.apply(package=package, source=source, create_directory=create_directory, throttle=throttle, observer=create_observer(progress, events))
+
+	# Only worth reporting when something has been asked for, triggers
+	# run often enough
+	logger.log(
+		logging.INFO if max_bytes_per_sec or max_ops_per_sec or idle else logging.DEBUG,
+		"%s",
+		throttle.report()
+	)
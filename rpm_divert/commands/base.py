@@ -67,12 +67,14 @@ def generate_arguments(commands):
 
 	for command in commands:
 		if not hasattr(command, "__subparser_details"):
-			continue
+			# Don't let a command silently disappear from the CLI
+			raise Exception("Command %s is not decorated with @command" % command.__name__)
 
 		details = getattr(command, "__subparser_details")
 
+		# export_script() is the export-script command
 		subparser = command_subparsers.add_parser(
-			command.__name__,
+			command.__name__.replace("_", "-"),
 			help=details.help
 		)
 
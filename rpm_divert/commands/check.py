@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# rpm-divert
+# Copyright (C) 2018 Eugenio "g7" Paolantonio
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of the <organization> nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import fnmatch
+
+import json
+
+import os
+
+import sys
+
+from .base import command
+
+from rpm_divert.diversion import DiversionKind
+
+__all__ = [
+	"check"
+]
+
+CHUNK_SIZE = 64 * 1024
+
+def _read_paths(stream, separator):
+	"""
+	Yields the paths read from a stream, a chunk at a time.
+
+	:param: stream: the binary stream to read
+	:param: separator: the path separator (b"\n" or b"\0")
+	:returns: a generator of lists of paths
+	"""
+
+	remainder = b""
+
+	while True:
+		chunk = stream.read1(CHUNK_SIZE)
+
+		if not chunk:
+			break
+
+		paths = (remainder + chunk).split(separator)
+		remainder = paths.pop()
+
+		yield [
+			path.decode("utf-8", "surrogateescape")
+			for path in paths
+			if path
+		]
+
+	if remainder:
+		yield [remainder.decode("utf-8", "surrogateescape")]
+
+def _lookup(path, index, directories, patterns):
+	"""
+	Finds the diversions a path is affected by.
+
+	:param: path: the path to look up
+	:param: index: a dictionary of exact path -> (role, package,
+	diversion) tuples
+	:param: directories: a dictionary of directory diversion path ->
+	(role, package, diversion) tuples
+	:param: patterns: a dictionary of directory -> (basename pattern,
+	package, diversion) tuples
+	:returns: a generator of (role, package, diversion) tuples
+	"""
+
+	exact = index.get(path, ())
+	yield from exact
+
+	if directories:
+		parent = os.path.dirname(path)
+
+		while parent and parent != "/":
+			for role, name, diversion in directories.get(parent, ()):
+				yield ("inside-%s" % role, name, diversion)
+
+			parent = os.path.dirname(parent)
+
+	if not exact and patterns:
+		directory, basename = os.path.split(path)
+
+		for pattern, name, diversion in patterns.get(directory, ()):
+			if fnmatch.fnmatchcase(basename, pattern):
+				yield ("pattern", name, diversion)
+
+@command(
+	help="reads paths from stdin and prints the diverted ones, as NDJSON",
+	args=[
+		(
+			"null",
+			{
+				"arguments" : ["--null", "-0"],
+				"action" : "store_true",
+				"help" : "if specified, paths are separated by NUL characters instead of newlines."
+			}
+		)
+	]
+)
+def check(database=None, null=False):
+
+	# Built once: exact path -> (role, package, diversion) tuples,
+	# the same for the directory diversions (whose content is diverted
+	# too), and directory -> (basename pattern, package, diversion)
+	# tuples for new pattern matches
+	index = {}
+	directories = {}
+	patterns = {}
+	for name, diversions in database.get_diversions().items():
+		for _diversion in diversions:
+			if _diversion.kind == DiversionKind.PATTERN:
+				directory, pattern = os.path.split(_diversion.source)
+				patterns.setdefault(directory, []).append((pattern, name, _diversion))
+			elif _diversion.kind == DiversionKind.DIRECTORY:
+				directories.setdefault(_diversion.source.rstrip("/"), []).append(("source", name, _diversion))
+				directories.setdefault(_diversion.diversion.rstrip("/"), []).append(("diversion", name, _diversion))
+
+			for diversion in _diversion.leaves():
+				index.setdefault(diversion.source, []).append(("source", name, diversion))
+				index.setdefault(diversion.diversion, []).append(("diversion", name, diversion))
+
+	for paths in _read_paths(sys.stdin.buffer, b"\0" if null else b"\n"):
+		matches = [
+			json.dumps(
+				{
+					"path" : path,
+					"role" : role,
+					"package" : name,
+					"source" : diversion.source,
+					"diversion" : diversion.diversion,
+					"applied" : diversion.applied
+				},
+				sort_keys=True
+			)
+			for path in paths
+			for role, name, diversion in _lookup(path, index, directories, patterns)
+		]
+
+		if matches:
+			sys.stdout.write("\n".join(matches) + "\n")
+			sys.stdout.flush()
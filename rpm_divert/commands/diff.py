@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+#
+# rpm-divert
+# Copyright (C) 2018 Eugenio "g7" Paolantonio
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of the <organization> nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+
+from .base import command
+
+from rpm_divert import Database
+
+from rpm_divert.diff import diff as diff_databases
+
+__all__ = [
+	"diff"
+]
+
+@command(
+	help="prints the differences between two diversion databases, as NDJSON",
+	args=[
+		(
+			"old",
+			{
+				"arguments" : ["old"],
+				"type" : str,
+				"help" : "the path of the old database"
+			}
+		),
+		(
+			"new",
+			{
+				"arguments" : ["new"],
+				"type" : str,
+				"help" : "the path of the new database"
+			}
+		)
+	]
+)
+def diff(database=None, old=None, new=None):
+
+	with Database.open(old, mode="r", cache=False) as old_database, Database.open(new, mode="r", cache=False) as new_database:
+		for record in diff_databases(old_database, new_database):
+			print(json.dumps(record, sort_keys=True))
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+# rpm-divert
+# Copyright (C) 2018 Eugenio "g7" Paolantonio
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of the <organization> nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+
+import sys
+
+from .base import command
+
+from rpm_divert.script import export_script as generate_script
+
+__all__ = [
+	"export_script"
+]
+
+@command(
+	help="generates a POSIX shell script that applies or unapplies the diversions without Python",
+	args=[
+		(
+			"output",
+			{
+				"arguments" : ["--output", "-o"],
+				"type" : str,
+				"help" : "the file to write the script to. If omitted, the script is printed."
+			}
+		),
+		(
+			"package",
+			{
+				"arguments" : ["--package", "-p"],
+				"type" : str,
+				"help" : "the package to process. If omitted, every diversion is exported."
+			}
+		),
+		(
+			"source",
+			{
+				"arguments" : ["--source", "-s"],
+				"type" : str,
+				"help" : "the diversion source to process. If omitted, every diversion is exported."
+			}
+		),
+		(
+			"create-directory",
+			{
+				"arguments" : ["--create-directory"],
+				"action" : "store_true",
+				"help" : "if specified, the script creates the diversion directory if it doesn't exist."
+			}
+		)
+	]
+)
+def export_script(database=None, output=None, package=None, source=None, create_directory=False):
+
+	script = generate_script(database, package=package, source=source, create_directory=create_directory)
+
+	if output is None:
+		sys.stdout.write(script)
+		return
+
+	with open(output, "w") as f:
+		f.write(script)
+
+	os.chmod(output, 0o755)
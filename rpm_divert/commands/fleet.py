@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+#
+# rpm-divert
+# Copyright (C) 2018 Eugenio "g7" Paolantonio
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of the <organization> nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+from itertools import repeat
+
+from .base import command
+
+from rpm_divert import Database, Diversion
+
+__all__ = [
+	"fleet"
+]
+
+def _process_root(root, manifest, operation, package, source, create_directory):
+	"""
+	Applies or unapplies the manifest diversions on a single root.
+
+	Runs in a worker process. The applied state is tracked by the
+	root's own database, which gets the missing diversions added. The
+	database is locked as a trigger would do, and if something fails
+	it is left to be recovered from its journal by the next run.
+
+	:param: root: the root directory
+	:param: manifest: the diversions to process, as returned by
+	Database.dump()
+	:param: operation: either "apply" or "unapply"
+	:param: package: the package to process, or None
+	:param: source: the diversion source to process, or None
+	:param: create_directory: passed as-is to Diversion.apply()
+	:returns: a dictionary containing the result
+	"""
+
+	result = {
+		"root" : root,
+		"processed" : 0,
+		"error" : None
+	}
+	start = time.monotonic()
+
+	try:
+		if not os.path.isdir(root):
+			raise Exception("%s is not a directory" % root)
+
+		database = Database.open(root=root)
+
+		try:
+			for pkg in manifest:
+				if package is not None and pkg["package"] != package:
+					continue
+
+				diversions = database[pkg["package"]].diversions
+				existing = {
+					diversion.source : diversion
+					for diversion in diversions
+				}
+
+				for diversion_dict in pkg["diversions"]:
+					if source is not None and diversion_dict["source"] != source:
+						continue
+
+					diversion = existing.get(diversion_dict["source"])
+					if diversion is None:
+						diversion = Diversion.new_from_dict(
+							{
+								key : value
+								for key, value in diversion_dict.items()
+								if key in ("source", "diversion", "action", "replacement", "kind")
+							}
+						)
+						diversions.add(diversion)
+
+					if operation == "apply":
+						diversion.apply(create_directory=create_directory, journal=database.journal, root=root)
+					else:
+						diversion.unapply(journal=database.journal, root=root)
+
+					result["processed"] += 1
+
+			database.commit()
+		finally:
+			database.close()
+	except Exception as e:
+		result["error"] = "%s: %s" % (type(e).__name__, e)
+
+	result["elapsed"] = time.monotonic() - start
+
+	return result
+
+@command(
+	help="applies or unapplies the diversions on many root filesystems in parallel",
+	args=[
+		(
+			"operation",
+			{
+				"arguments" : ["operation"],
+				"type" : str,
+				"choices" : ["apply", "unapply"],
+				"help" : "the operation to run on every root"
+			}
+		),
+		(
+			"roots",
+			{
+				"arguments" : ["roots"],
+				"type" : str,
+				"nargs" : "+",
+				"metavar" : "root",
+				"help" : "the root directories to process"
+			}
+		),
+		(
+			"manifest",
+			{
+				"arguments" : ["--manifest", "-m"],
+				"type" : str,
+				"default" : None,
+				"help" : "the diversion database to read the diversions from. If omitted, the current database is used."
+			}
+		),
+		(
+			"jobs",
+			{
+				"arguments" : ["--jobs", "-j"],
+				"type" : int,
+				"default" : None,
+				"help" : "the maximum number of roots processed at the same time. Defaults to the number of CPUs."
+			}
+		),
+		(
+			"package",
+			{
+				"arguments" : ["--package", "-p"],
+				"type" : str,
+				"help" : "the package to process. If omitted, every diversion is processed."
+			}
+		),
+		(
+			"source",
+			{
+				"arguments" : ["--source", "-s"],
+				"type" : str,
+				"help" : "the diversion source to process. If omitted, every diversion is processed."
+			}
+		),
+		(
+			"create-directory",
+			{
+				"arguments" : ["--create-directory"],
+				"action" : "store_true",
+				"help" : "if specified, creates the diversion directory if it doesn't exist."
+			}
+		)
+	]
+)
+def fleet(database=None, operation=None, roots=[], manifest=None, jobs=None, package=None, source=None, create_directory=False):
+
+	if manifest is not None:
+		with Database.open(manifest, mode="r", cache=False) as manifest_database:
+			manifest = manifest_database.dump()
+	else:
+		manifest = database.dump()
+
+	with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+		results = list(
+			executor.map(
+				_process_root,
+				roots,
+				repeat(manifest),
+				repeat(operation),
+				repeat(package),
+				repeat(source),
+				repeat(create_directory)
+			)
+		)
+
+	failed = 0
+	for result in results:
+		if result["error"] is None:
+			print("%s: ok, %d diversions in %.2fs" % (result["root"], result["processed"], result["elapsed"]))
+		else:
+			failed += 1
+			print("%s: failed after %d diversions in %.2fs: %s" % (result["root"], result["processed"], result["elapsed"], result["error"]))
+
+	print("%d of %d roots processed successfully" % (len(results) - failed, len(results)))
+
+	if failed:
+		raise Exception("%d roots failed" % failed)
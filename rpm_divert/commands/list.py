@@ -56,7 +56,8 @@ def list(database=None, package=None):
 					name
 				)
 				for name, diversions in database.get_diversions(package=package).items()
-				for diversion in diversions
+				for _diversion in diversions
+				for diversion in _diversion.leaves()
 				if diversion.applied
 			]
 		)
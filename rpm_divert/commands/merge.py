@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# rpm-divert
+# Copyright (C) 2018 Eugenio "g7" Paolantonio
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of the <organization> nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import json
+
+import logging
+
+import sys
+
+from .base import command
+
+from rpm_divert.diff import apply_diff
+
+__all__ = [
+	"merge"
+]
+
+logger = logging.getLogger(__name__)
+
+@command(
+	help="applies a diff (as printed by diff) to the diversion database",
+	args=[
+		(
+			"diff",
+			{
+				"arguments" : ["diff"],
+				"type" : str,
+				"help" : "the NDJSON diff file, or '-' to read it from stdin"
+			}
+		)
+	]
+)
+def merge(database=None, diff=None):
+
+	f = sys.stdin if diff == "-" else open(diff, "r")
+
+	try:
+		records = [
+			json.loads(line)
+			for line in f
+			if line.strip()
+		]
+	finally:
+		if f is not sys.stdin:
+			f.close()
+
+	try:
+		merged = apply_diff(database, records)
+	except:
+		# Don't let the partial merge be saved
+		database.rollback()
+		raise
+
+	logger.info("merged %d changes", merged)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#
+# rpm-divert
+# Copyright (C) 2018 Eugenio "g7" Paolantonio
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of the <organization> nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import logging
+
+from .base import command
+
+__all__ = [
+	"reconcile"
+]
+
+logger = logging.getLogger(__name__)
+
+@command(
+	help="re-applies the diversions that drifted since the last operation",
+	args=[
+		(
+			"package",
+			{
+				"arguments" : ["--package", "-p"],
+				"type" : str,
+				"help" : "the package to process. If omitted, every diversion is checked."
+			}
+		),
+		(
+			"source",
+			{
+				"arguments" : ["--source", "-s"],
+				"type" : str,
+				"help" : "the diversion source to process. If omitted, every diversion is checked."
+			}
+		)
+	]
+)
+def reconcile(database=None, source=None, package=None):
+
+	checked = 0
+	drifted = 0
+
+	for name, diversion in database.find(package=package, source=source):
+		checked += 1
+		if diversion.reconcile(journal=database.journal, root=database.root):
+			drifted += 1
+
+	logger.info("%d of %d diversions drifted", drifted, checked)
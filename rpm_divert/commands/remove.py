@@ -26,21 +26,26 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import logging
+
 from .base import command
 
 __all__ = [
 	"remove"
 ]
 
+logger = logging.getLogger(__name__)
+
 @command(
-	help="removes a diversion",
+	help="removes diversions",
 	args=[
 		(
 			"package",
 			{
 				"arguments" : ["package"],
 				"type" : str,
-				"help" : "the package where to link the diversion"
+				"nargs" : "?",
+				"help" : "the package where to link the diversion. If omitted, every package is processed (with --all, --prefix or --glob)."
 			}
 		),
 		(
@@ -48,22 +53,55 @@ __all__ = [
 			{
 				"arguments" : ["source"],
 				"type" : str,
-				"help" : "the file to divert"
+				"nargs" : "?",
+				"help" : "the file to divert. If omitted, --all, --prefix or --glob select the diversions to remove."
+			}
+		),
+		(
+			"all",
+			{
+				"arguments" : ["--all"],
+				"action" : "store_true",
+				"help" : "if specified, removes every diversion of the package (or every diversion, if no package is given)."
+			}
+		),
+		(
+			"prefix",
+			{
+				"arguments" : ["--prefix"],
+				"type" : str,
+				"help" : "removes the diversions whose source is in the given directory."
+			}
+		),
+		(
+			"glob",
+			{
+				"arguments" : ["--glob"],
+				"type" : str,
+				"help" : "removes the diversions whose source matches the given glob pattern."
+			}
+		),
+		(
+			"unapply",
+			{
+				"arguments" : ["--unapply"],
+				"action" : "store_true",
+				"help" : "if specified, unapplies the applied diversions before removing them, instead of failing."
 			}
 		)
 	]
 )
-def remove(database=None, package=None, source=None):
-
-	for diversion in [x for x in database[package].diversions]:
-		if diversion.source != source:
-			continue
+def remove(database=None, package=None, source=None, all=False, prefix=None, glob=None, unapply=False):
 
-		if diversion.applied:
-			raise Exception("Diversion %s is still applied" % diversion)
+	if source is None and not (all or prefix or glob):
+		raise Exception("Either a source, --all, --prefix or --glob must be specified")
 
-		database[package].diversions.remove(diversion)
+	removed = database.remove(
+		package=package,
+		source=source,
+		prefix=prefix,
+		pattern=glob,
+		unapply=unapply
+	)
 
-	# Clean up the whole package if there are no diversions
-	if not database[package].diversions:
-		del database[package]
+	logger.info("removed %d diversions", len(removed))
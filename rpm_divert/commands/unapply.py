@@ -28,6 +28,8 @@
 
 from .base import command
 
+from rpm_divert.events import EVENT_FORMATS, create_observer
+
 __all__ = [
 	"unapply"
 ]
@@ -50,22 +52,37 @@ __all__ = [
 				"type" : str,
 				"help" : "the diversion source to process. If omitted, every diversion is applied."
 			}
+		),
+		(
+			"defer",
+			{
+				"arguments" : ["--defer"],
+				"action" : "store_true",
+				"help" : "if specified, queues the request until the next flush instead of unapplying it right away."
+			}
+		),
+		(
+			"progress",
+			{
+				"arguments" : ["--progress"],
+				"action" : "store_true",
+				"help" : "if specified, shows the progress on stderr."
+			}
+		),
+		(
+			"events",
+			{
+				"arguments" : ["--events"],
+				"choices" : EVENT_FORMATS,
+				"help" : "writes the progress events to stdout, in the given format."
+			}
 		)
 	]
 )
-def unapply(database=None, source=None, package=None):
+def unapply(database=None, source=None, package=None, defer=False, progress=False, events=None):
 
-	for diversion in (
-		div
-		for div in (
-			[
-				div
-				for pkg in database
-				for div in database[pkg].diversions
-			]
-			if package is None
-			else database[package].diversions
-		)
-		if source is None or div.source == source
-	):
-		diversion.unapply()
+	if defer:
+		database.pending.append("unapply", package=package, source=source)
+		return
+
+	database.unapply(package=package, source=source, observer=create_observer(progress, events))
@@ -47,22 +47,69 @@ Its structure is similar to the following:
 ]
 
 This is optimized for legibility, not for performance.
+
+To avoid parsing it on every invocation, the loaded database is also
+cached next to it (in "diversions.cache") as marshal'd tuples, along with
+the stat() stamp of the JSON file it comes from. The cache is used only
+while the stamp matches.
 """
 
+import fcntl
+
+import fnmatch
+
+import itertools
+
 import json
 
 import logging
 
+import marshal
+
 import os
 
+import struct
+
+import time
+
+from rpm_divert.backend import OS_BACKEND
+
+from rpm_divert.diversion import Diversion, DiversionAction, DiversionKind, PatternDiversion
+
+from rpm_divert.events import Observer
+
+from rpm_divert.index import write_index, SOURCE, DIVERSION, APPLIED
+
 from rpm_divert.package import Package
 
+from rpm_divert.pending import PendingQueue
+
+from rpm_divert.journal import Journal
+
+from rpm_divert.rootfs import resolve
+
+from rpm_divert.stamp import request_key, read_stamp, write_stamp
+
+from rpm_divert.throttle import Throttle
+
 __all__ = [
 	"Database"
 ]
 
 DEFAULT_DATABASE_PATH = "/var/lib/rpm-divert/diversions"
 
+# Bump when Package.pack() or Diversion.pack() change
+CACHE_FORMAT = 2
+
+# Used when no observer has been supplied
+NO_OBSERVER = Observer()
+
+# The buffer size used when saving
+CHUNK_SIZE = 1024 * 1024
+
+# Length prefix of the marshalled records in the cache
+CACHE_RECORD = struct.Struct("<I")
+
 logger = logging.getLogger(__name__)
 
 class Database:
@@ -71,20 +118,196 @@ class Database:
 	The actual database.
 	"""
 
-	def __init__(self, path=None):
+	MODES = ("r", "rw")
+
+	def __init__(self, path=None, root=None, load=True, cache=True, layers=(), compact=False, backend=None):
 		"""
 		Initialises the class.
 
 		:param: path: the database path. If None, defaults to
 		/var/lib/rpm-divert/diversions
+		:param: root: the root directory to operate on. If not None, the
+		database path and every diversion path are resolved inside it.
+		Defaults to None (the running system).
+		:param: load: if True (the default), loads the database right
+		away.
+		:param: cache: if True (the default), uses and maintains the
+		parsed database cache.
+		:param: layers: the paths of read-only databases to stack below
+		this one, from the lowest priority to the highest. Diversions
+		are looked up through every layer, but only the ones that are
+		not in the layers (or that changed) are saved.
+		:param: compact: if True, the database is saved without
+		indentation. Defaults to False.
+		:param: backend: the filesystem backend diversions are applied
+		on. Defaults to None (the host filesystem). The database itself
+		is always stored on the host filesystem, and the operation
+		journal is only kept for the host filesystem.
 		"""
 
-		self.path = path or DEFAULT_DATABASE_PATH
+		self.root = root
+		self.path = resolve(root, path or DEFAULT_DATABASE_PATH)
+		self.cache_path = "%s.cache" % self.path if cache else None
+		self.index_path = "%s.index" % self.path
+		self.compact = compact
+		self.backend = backend or OS_BACKEND
+		self.layers = [
+			resolve(root, layer)
+			for layer in layers
+		]
+
+		# (package, source) -> packed diversion, as found in the layers
+		self._layered = {}
+
+		# (operation, package, source) requests to check for the stamp
+		self._requests = set()
+
+		# Set by open()
+		self.mode = None
+		self._lock_fd = None
+
+		self.pending = PendingQueue("%s.pending" % self.path)
+		# The journal describes host paths, it would be recovered against
+		# the host filesystem by the next run. Other backends get none.
+		self.journal = Journal(
+			"%s.journal" % self.path if self.backend is OS_BACKEND else None,
+			backend=self.backend
+		)
 
 		self._packages = {}
 		self._packages_iterator = None
 
-		self.load()
+		if load:
+			self.load()
+
+	@classmethod
+	def open(cls, path=None, mode="rw", root=None, cache=True, layers=(), compact=False, backend=None):
+		"""
+		Opens the database for in-process use.
+
+		The database is locked (shared when read-only, exclusive
+		otherwise) until close() is called. When used as a context
+		manager, changes are committed on a clean exit and rolled back
+		if an exception is raised:
+
+			with Database.open(mode="rw") as db:
+				db.add("custom-hello", "/usr/bin/hello", "/usr/bin/hello-diverted")
+				db.apply(package="custom-hello")
+
+		:param: path: the database path. If None, defaults to
+		/var/lib/rpm-divert/diversions
+		:param: mode: "r" (read-only, never saved) or "rw". Defaults to
+		"rw".
+		:param: root: the root directory to operate on. Defaults to None
+		(the running system).
+		:param: cache: if True (the default), uses and maintains the
+		parsed database cache.
+		:param: layers: the paths of read-only databases to stack below
+		this one, from the lowest priority to the highest.
+		:param: compact: if True, the database is saved without
+		indentation. Defaults to False.
+		:param: backend: the filesystem backend diversions are applied
+		on. Defaults to None (the host filesystem).
+		:returns: a loaded Database() object
+		"""
+
+		if not mode in cls.MODES:
+			raise Exception("Unknown mode %s" % mode)
+
+		database = cls(path, root=root, load=False, cache=cache, layers=layers, compact=compact, backend=backend)
+		database.mode = mode
+
+		directory = os.path.dirname(database.path)
+
+		if mode == "rw" and not os.path.exists(directory):
+			os.makedirs(directory)
+
+		try:
+			# Readers don't create the lock, the database might be on a
+			# read-only filesystem
+			database._lock_fd = os.open(
+				"%s.lock" % database.path,
+				os.O_RDWR | os.O_CREAT if mode == "rw" else os.O_RDONLY,
+				0o644
+			)
+		except FileNotFoundError:
+			# Nothing has ever written there
+			pass
+		else:
+			fcntl.flock(
+				database._lock_fd,
+				fcntl.LOCK_EX if mode == "rw" else fcntl.LOCK_SH
+			)
+
+		database.load()
+
+		return database
+
+	def close(self):
+		"""
+		Releases the lock taken by open(). Uncommitted changes are not
+		saved.
+		"""
+
+		self.journal.close()
+
+		if self._lock_fd is not None:
+			os.close(self._lock_fd)
+			self._lock_fd = None
+
+	def commit(self):
+		"""
+		Saves the changes. Does nothing on read-only databases.
+		"""
+
+		if self.mode != "r":
+			self.save()
+
+	def rollback(self):
+		"""
+		Reverts the filesystem operations done since the last commit,
+		and reloads the database.
+		"""
+
+		if self.mode == "r":
+			return
+
+		self._packages = {}
+		self.load(recover=False)
+
+		if self.journal.pending():
+			# Operations that can't be undone are kept, and recorded
+			self.journal.recover(self, rollback=True)
+			self.save()
+
+	def __enter__(self):
+		"""
+		:returns: this Database() instance
+		"""
+
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		"""
+		Commits the changes, or rolls them back if an exception has been
+		raised, and closes the database.
+		"""
+
+		try:
+			if exc_type is None:
+				self.commit()
+			else:
+				self.rollback()
+		finally:
+			self.close()
+
+	def _check_writable(self):
+		"""
+		Raises an exception if the database has been opened read-only.
+		"""
+
+		if self.mode == "r":
+			raise Exception("The diversion database has been opened read-only")
 
 	def __iter__(self):
 		"""
@@ -158,6 +381,251 @@ class Database:
 			for name, pkg in self._packages.items()
 		}
 
+	def find(self, package=None, source=None):
+		"""
+		Finds diversions.
+
+		:param: package: if not None, limits the search on the given
+		package
+		:param: source: if not None, limits the search on the given
+		diversion source
+		:returns: a list of (package name, Diversion) tuples
+		"""
+
+		return [
+			(name, diversion)
+			for name, diversions in self.get_diversions(package=package).items()
+			for diversion in diversions
+			if source is None or diversion.source == source
+		]
+
+	def is_layered(self, package, source):
+		"""
+		:param: package: the package name
+		:param: source: the diversion source
+		:returns: True if the diversion comes from a read-only layer,
+		False otherwise.
+		"""
+
+		return (package, source) in self._layered
+
+	def add(self, package, source, diversion, action=DiversionAction.NOTHING, replacement=None, kind=DiversionKind.FILE):
+		"""
+		Adds a diversion. It is not applied.
+
+		:param: package: the package name (str) where to link the
+		diversion
+		:param: source: the file to divert (str)
+		:param: diversion: the path the source is renamed to (str)
+		:param: action: the DiversionAction. Defaults to
+		DiversionAction.NOTHING
+		:param: replacement: the replacement file (str), used by the
+		symlink and copy actions
+		:param: kind: the DiversionKind. Defaults to DiversionKind.FILE.
+		With DiversionKind.PATTERN, the source basename is a shell-style
+		pattern and diversion (and replacement) templates, see
+		PatternDiversion.
+		:returns: the new Diversion() object
+		"""
+
+		self._check_writable()
+
+		if kind == DiversionKind.PATTERN and True in (
+			x in os.path.dirname(source)
+			for x in "*?["
+		):
+			raise Exception("Only the last component of a pattern can contain wildcards")
+
+		# FIXME: check for the diversion source globally to avoid conflicts
+		# between packages diverting the same file
+
+		_diversion = (PatternDiversion if kind == DiversionKind.PATTERN else Diversion)(
+			source,
+			diversion,
+			action=action,
+			replacement=replacement,
+			kind=kind
+		)
+		self[package].diversions.add(_diversion)
+
+		return _diversion
+
+	def remove(self, package=None, source=None, prefix=None, pattern=None, unapply=False):
+		"""
+		Removes diversions. They must not be applied, unless unapply is
+		True.
+
+		The whole selection is checked before touching anything, so
+		either every selected diversion is removed or none is.
+
+		:param: package: the package name (str). If None, every package
+		is processed.
+		:param: source: the diversion source (str). If None, every
+		diversion is processed.
+		:param: prefix: if not None, only removes the diversions whose
+		source is in the given directory
+		:param: pattern: if not None, only removes the diversions whose
+		source matches the given glob pattern
+		:param: unapply: if True, unapplies the applied diversions first.
+		Defaults to False.
+		:returns: the list of removed (package name, Diversion) tuples
+		"""
+
+		self._check_writable()
+
+		if prefix is not None:
+			prefix = prefix.rstrip("/") + "/"
+
+		selected = [
+			(name, diversion)
+			for name, diversion in self.find(package=package, source=source)
+			if (prefix is None or diversion.source.startswith(prefix))
+			and (pattern is None or fnmatch.fnmatchcase(diversion.source, pattern))
+		]
+
+		# Validate
+		layered = [
+			diversion
+			for name, diversion in selected
+			if self.is_layered(name, diversion.source)
+		]
+		if layered:
+			raise Exception("Diversions %s come from a read-only layer" % ", ".join(str(x) for x in layered))
+
+		applied = [
+			diversion
+			for name, diversion in selected
+			if diversion.applied
+		]
+		if applied and not unapply:
+			raise Exception("Diversions %s are still applied" % ", ".join(str(x) for x in applied))
+
+		for diversion in applied:
+			diversion.unapply(journal=self.journal, root=self.root)
+
+		for name, diversion in selected:
+			diversion.forget(journal=self.journal, root=self.root)
+
+		# Remove, a package at a time
+		by_package = {}
+		for name, diversion in selected:
+			by_package.setdefault(name, set()).add(diversion)
+
+		for name, diversions in by_package.items():
+			self._packages[name].diversions -= diversions
+
+			# Clean up the whole package if there are no diversions
+			if not self._packages[name].diversions:
+				del self[name]
+
+		return selected
+
+	def _process(self, operation, selected, run, throttle=None, observer=None):
+		"""
+		Runs an operation on the selected diversions, reporting to the
+		observer.
+
+		:param: operation: the operation name
+		:param: selected: the list of (package name, Diversion) tuples
+		:param: run: the callable processing a Diversion()
+		:param: throttle: the Throttle() pacing the filesystem steps, or
+		None
+		:param: observer: the Observer() to report to, or None
+		"""
+
+		if observer is None:
+			observer = NO_OBSERVER
+		elif throttle is None:
+			# Only to count the copied bytes
+			throttle = Throttle()
+
+		observer.plan_ready(operation, selected)
+
+		self.journal.throttle = throttle
+		try:
+			for name, diversion in selected:
+				observer.op_start(operation, name, diversion)
+
+				started = time.monotonic()
+				copied = throttle.bytes if throttle is not None else 0
+
+				try:
+					run(diversion)
+				except Exception as e:
+					observer.op_failed(operation, name, diversion, e, time.monotonic() - started)
+					raise
+
+				observer.op_done(
+					operation,
+					name,
+					diversion,
+					(throttle.bytes if throttle is not None else 0) - copied,
+					time.monotonic() - started
+				)
+		finally:
+			self.journal.throttle = None
+
+	def apply(self, package=None, source=None, create_directory=False, throttle=None, observer=None):
+		"""
+		Applies diversions.
+
+		:param: package: the package name (str) to process. If None,
+		every package is processed.
+		:param: source: the diversion source (str) to process. If None,
+		every diversion is processed.
+		:param: create_directory: if True, creates the directory tree
+		of the diversions if it doesn't exist. Defaults to False.
+		:param: throttle: the Throttle() pacing the filesystem steps.
+		Defaults to None (no limits).
+		:param: observer: the Observer() receiving the progress events.
+		Defaults to None.
+		:returns: the list of processed Diversion() objects
+		"""
+
+		self._check_writable()
+
+		selected = self.find(package=package, source=source)
+
+		self._process(
+			"apply",
+			selected,
+			lambda diversion: diversion.apply(create_directory=create_directory, journal=self.journal, root=self.root),
+			throttle=throttle,
+			observer=observer
+		)
+
+		self._requests.add(("apply", package, source))
+
+		return [diversion for name, diversion in selected]
+
+	def unapply(self, package=None, source=None, observer=None):
+		"""
+		Unapplies diversions.
+
+		:param: package: the package name (str) to process. If None,
+		every package is processed.
+		:param: source: the diversion source (str) to process. If None,
+		every diversion is processed.
+		:param: observer: the Observer() receiving the progress events.
+		Defaults to None.
+		:returns: the list of processed Diversion() objects
+		"""
+
+		self._check_writable()
+
+		selected = self.find(package=package, source=source)
+
+		self._process(
+			"unapply",
+			selected,
+			lambda diversion: diversion.unapply(journal=self.journal, root=self.root),
+			observer=observer
+		)
+
+		self._requests.add(("unapply", package, source))
+
+		return [diversion for name, diversion in selected]
+
 	def dump(self):
 		"""
 		Dumps the database as a list of Packages.
@@ -173,6 +641,13 @@ class Database:
 	def save(self):
 		"""
 		Saves the database to self.path.
+
+		The database is written to a temporary file which then replaces
+		the old one, and the journal is cleared only afterwards.
+
+		Packages are encoded and written one at a time, sorted by name
+		(and their diversions by source), so that the output is
+		deterministic and no copy of the whole database is ever built.
 		"""
 
 		directory = os.path.dirname(self.path)
@@ -180,27 +655,310 @@ class Database:
 		if not os.path.exists(directory):
 			os.makedirs(directory)
 
-		with open(self.path, "w") as f:
-			f.write(
-				json.dumps(
-					self.dump(),
-					indent=4,
-					sort_keys=True
-				)
+		temporary_path = "%s.new" % self.path
+
+		packages = sorted(self._overlay_packages(), key=lambda pkg: pkg.name)
+
+		if self.compact:
+			encoder = json.JSONEncoder(separators=(",", ":"), sort_keys=True)
+			separator = ","
+		else:
+			encoder = json.JSONEncoder(indent=4, sort_keys=True)
+			separator = ",\n    "
+
+		with open(temporary_path, "w", buffering=CHUNK_SIZE) as f:
+			f.write("[" if self.compact or not packages else "[\n    ")
+
+			for position, pkg in enumerate(packages):
+				if position:
+					f.write(separator)
+
+				for chunk in encoder.iterencode(pkg.dump()):
+					# Newlines are only used for indentation, strings
+					# have them escaped
+					f.write(chunk if self.compact else chunk.replace("\n", "\n    "))
+
+			f.write("]" if self.compact or not packages else "\n]")
+			f.flush()
+			os.fsync(f.fileno())
+
+		os.replace(temporary_path, self.path)
+
+		self._save_cache(os.stat(self.path), packages)
+
+		write_index(self.index_path, self._index_entries())
+
+		self.journal.clear()
+
+		self._save_stamp()
+
+	def _save_stamp(self):
+		"""
+		Writes the state stamp, with the requests (the ones done since
+		load() and the ones already in the stamp) that would now change
+		nothing.
+
+		Layered databases and other backends than the host filesystem
+		get no stamp, as the stamp can't tell whether they changed.
+		"""
+
+		stamp_path = "%s.stamp" % self.path
+
+		if self.layers or self.backend is not OS_BACKEND:
+			if os.path.exists(stamp_path):
+				os.remove(stamp_path)
+			return
+
+		requests = {}
+
+		for operation, package, source in self._requests:
+			paths = self._noop_paths(operation, package, source)
+
+			if paths is not None:
+				requests[request_key(operation, package, source)] = paths
+
+		try:
+			write_stamp(self.path, requests)
+		except OSError as e:
+			logger.debug("Unable to write the state stamp: %s", e)
+
+			if os.path.exists(stamp_path):
+				os.remove(stamp_path)
+
+	def _noop_paths(self, operation, package=None, source=None):
+		"""
+		Checks whether a request would change nothing in the current
+		state.
+
+		:param: operation: "apply" or "unapply"
+		:param: package: the requested package, or None
+		:param: source: the requested source, or None
+		:returns: the host paths the answer depends on, or None if the
+		request would change something
+		"""
+
+		applied = operation == "apply"
+		paths = []
+
+		for name, diversion in self.find(package=package, source=source):
+			leaves = diversion.leaves()
+
+			if diversion.applied != applied or [leaf for leaf in leaves if leaf.applied != applied]:
+				return None
+			elif isinstance(diversion, PatternDiversion):
+				if not applied and leaves:
+					return None
+				elif applied and diversion.expand(self.root):
+					return None
+
+				# New matches show up in the directory
+				paths.append(resolve(self.root, os.path.dirname(diversion.source)))
+
+			for leaf in leaves:
+				paths.extend(leaf.host_paths(self.root)[:2])
+
+		return paths
+
+	def _index_entries(self):
+		"""
+		Collects the diverted paths for the index, the layered ones
+		included.
+
+		:returns: a dictionary of path -> index flags
+		"""
+
+		entries = {}
+
+		for pkg in self._packages.values():
+			for diversion in pkg.diversions:
+				for leaf in diversion.leaves():
+					applied = APPLIED if leaf.applied else 0
+
+					entries[leaf.source] = \
+						entries.get(leaf.source, 0) | SOURCE | applied
+					entries[leaf.diversion] = \
+						entries.get(leaf.diversion, 0) | DIVERSION | applied
+
+		return entries
+
+	def _overlay_packages(self):
+		"""
+		Returns the packages to be saved, i.e. without the diversions
+		that are unchanged from the read-only layers.
+
+		:returns: a list of Package() objects
+		"""
+
+		if not self._layered:
+			return list(self._packages.values())
+
+		packages = []
+
+		for name, pkg in self._packages.items():
+			diversions = set(
+				diversion
+				for diversion in pkg.diversions
+				if self._layered.get((name, diversion.source)) != diversion.pack()
 			)
 
-	def load(self):
+			if diversions:
+				overlay = Package(name)
+				overlay.diversions = diversions
+				packages.append(overlay)
+
+		return packages
+
+	@staticmethod
+	def _cache_stamp(st):
 		"""
-		Loads the database.
+		:param: st: the stat() result of the JSON database
+		:returns: the stamp the cache is validated against
 		"""
 
-		if not os.path.exists(self.path):
-			logger.warning("Diversion database doesn't exist")
+		return (CACHE_FORMAT, marshal.version, st.st_mtime_ns, st.st_size, st.st_ino)
+
+	def _load_cache(self, st):
+		"""
+		Loads the packages from the cache.
+
+		:param: st: the stat() result of the JSON database
+		:returns: a list of Package() objects, or None if the cache is
+		missing or stale.
+		"""
+
+		if self.cache_path is None:
+			return None
+
+		try:
+			with open(self.cache_path, "rb") as f:
+				data = memoryview(f.read())
+
+			packages = []
+			offset = 0
+			while offset < len(data):
+				length, = CACHE_RECORD.unpack_from(data, offset)
+				offset += CACHE_RECORD.size
+
+				record = marshal.loads(data[offset:offset + length])
+				offset += length
+
+				if not packages and record != (self._cache_stamp(st), record[1]):
+					return None
+
+				packages.append(record)
+		except (OSError, EOFError, ValueError, TypeError, IndexError, struct.error):
+			return None
+
+		# A truncated cache
+		if not packages or len(packages) - 1 != packages[0][1]:
+			return None
+
+		return [
+			Package.unpack(packed)
+			for packed in packages[1:]
+		]
+
+	def _save_cache(self, st, packages):
+		"""
+		Writes the cache of the given packages. Failures are not fatal.
+
+		The cache is a sequence of length-prefixed marshalled records:
+		the stamp with the number of packages, and then every packed
+		package, written one at a time.
+
+		:param: st: the stat() result of the JSON database the packages
+		come from
+		:param: packages: the list of Package() objects to cache
+		"""
+
+		if self.cache_path is None:
 			return
 
+		temporary_path = "%s.new" % self.cache_path
+
+		try:
+			with open(temporary_path, "wb", buffering=CHUNK_SIZE) as f:
+				header = (self._cache_stamp(st), len(packages))
+
+				for record in itertools.chain((header,), (pkg.pack() for pkg in packages)):
+					data = marshal.dumps(record)
+
+					f.write(CACHE_RECORD.pack(len(data)))
+					f.write(data)
+
+			os.replace(temporary_path, self.cache_path)
+		except OSError as e:
+			logger.debug("Unable to write the database cache: %s", e)
+
+	def _read(self):
+		"""
+		Reads the database file, through the cache if it is fresh.
+
+		:returns: a list of Package() objects
+		"""
+
+		if not os.path.exists(self.path):
+			logger.warning("Diversion database %s doesn't exist", self.path)
+			return []
+
 		with open(self.path, "r") as f:
-			_diversions = json.loads(f.read())
+			# fstat() the file actually read, save() might be
+			# replacing it right now
+			st = os.fstat(f.fileno())
+
+			packages = self._load_cache(st)
+
+			if packages is None:
+				packages = [
+					Package.new_from_dict(pkg)
+					for pkg in json.loads(f.read())
+				]
+
+				self._save_cache(st, packages)
+
+		return packages
+
+	def load(self, recover=True):
+		"""
+		Loads the database, on top of its read-only layers.
+
+		:param: recover: if True (the default), an interrupted run found
+		in the journal is recovered and saved.
+		"""
+
+		self._layered = {}
+
+		self._requests = set(
+			tuple(json.loads(key))
+			for key in read_stamp(self.path)
+		)
 
-		for pkg in _diversions:
-			_pkg = Package.new_from_dict(pkg)
-			self._packages[_pkg.name] = _pkg
+		for layer in self.layers:
+			base = Database(layer, load=False, cache=self.cache_path is not None)
+
+			for pkg in base._read():
+				for diversion in pkg.diversions:
+					# Override the lower layers
+					self[pkg.name].diversions.discard(diversion)
+					self[pkg.name].diversions.add(diversion)
+					self._layered[(pkg.name, diversion.source)] = diversion.pack()
+
+		for pkg in self._read():
+			if not pkg.name in self._packages:
+				self._packages[pkg.name] = pkg
+				continue
+
+			# Override the layers
+			for diversion in pkg.diversions:
+				self._packages[pkg.name].diversions.discard(diversion)
+				self._packages[pkg.name].diversions.add(diversion)
+
+		# Recover an interrupted run
+		if not recover:
+			pass
+		elif self.mode == "r" and self.journal.pending():
+			logger.warning("Found an incomplete operation journal, not recovering in read-only mode")
+		elif self.journal.pending():
+			logger.warning("Found an incomplete operation journal, recovering")
+			self.journal.recover(self)
+			self.save()
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+#
+# rpm-divert
+# Copyright (C) 2018 Eugenio "g7" Paolantonio
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of the <organization> nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Differences between diversion databases.
+
+A diff is a stream of records, one per diversion that differs:
+
+	{"op": "added", "package": "custom-hello", "source": "/usr/bin/hello", "new": {...}}
+	{"op": "removed", "package": "custom-hello", "source": "/usr/bin/hello", "old": {...}}
+	{"op": "changed", "package": "custom-hello", "source": "/usr/bin/hello", "old": {...}, "new": {...}}
+
+where "old" and "new" are the diversion definitions. The applied state is
+local to every host, so it is never compared.
+"""
+
+from rpm_divert.diversion import DiversionKind
+
+__all__ = [
+	"diff",
+	"apply_diff"
+]
+
+# The keys that define a diversion, besides its source
+DEFINITION_KEYS = ("diversion", "action", "replacement", "kind")
+
+OPERATIONS = ("added", "removed", "changed")
+
+def _definition(diversion):
+	"""
+	:param: diversion: the Diversion() object
+	:returns: a dictionary containing the diversion definition
+	"""
+
+	return {
+		"diversion" : diversion.diversion,
+		"action" : diversion.action,
+		"replacement" : diversion.replacement,
+		"kind" : diversion.kind
+	}
+
+def _sorted_diversions(database):
+	"""
+	:param: database: the Database() object
+	:returns: the list of (package, source, Diversion) tuples, sorted
+	by package and source.
+	"""
+
+	return sorted(
+		(
+			(name, diversion.source, diversion)
+			for name, diversion in database.find()
+		),
+		key=lambda x: (x[0], x[1])
+	)
+
+def diff(a, b):
+	"""
+	Compares two databases, with a linear walk of both.
+
+	:param: a: the old Database()
+	:param: b: the new Database()
+	:returns: a generator of diff records, sorted by package and source
+	"""
+
+	a_diversions = _sorted_diversions(a)
+	b_diversions = _sorted_diversions(b)
+
+	i = j = 0
+
+	while i < len(a_diversions) or j < len(b_diversions):
+		a_key = a_diversions[i][:2] if i < len(a_diversions) else None
+		b_key = b_diversions[j][:2] if j < len(b_diversions) else None
+
+		if b_key is None or (a_key is not None and a_key < b_key):
+			yield {
+				"op" : "removed",
+				"package" : a_key[0],
+				"source" : a_key[1],
+				"old" : _definition(a_diversions[i][2])
+			}
+			i += 1
+		elif a_key is None or b_key < a_key:
+			yield {
+				"op" : "added",
+				"package" : b_key[0],
+				"source" : b_key[1],
+				"new" : _definition(b_diversions[j][2])
+			}
+			j += 1
+		else:
+			old = _definition(a_diversions[i][2])
+			new = _definition(b_diversions[j][2])
+
+			if old != new:
+				yield {
+					"op" : "changed",
+					"package" : a_key[0],
+					"source" : a_key[1],
+					"old" : old,
+					"new" : new
+				}
+
+			i += 1
+			j += 1
+
+def apply_diff(database, records):
+	"""
+	Applies diff records to a database, all or nothing: the whole diff is
+	validated before changing anything.
+
+	Removed and changed diversions must not be applied, nor come from a
+	read-only layer.
+
+	:param: database: the Database() to update
+	:param: records: an iterable of diff records
+	:returns: the number of applied records
+	"""
+
+	records = list(records)
+
+	existing = {
+		(name, diversion.source) : diversion
+		for name, diversion in database.find()
+	}
+
+	# Validate
+	for record in records:
+		if not record.get("op") in OPERATIONS:
+			raise Exception("Unknown diff operation %s" % record.get("op"))
+
+		key = (record["package"], record["source"])
+		diversion = existing.get(key)
+
+		if record["op"] == "added":
+			if diversion is not None and _definition(diversion) != record["new"]:
+				raise Exception("Diversion of %s by %s already exists" % key[::-1])
+		elif diversion is None:
+			raise Exception("Diversion of %s by %s doesn't exist" % key[::-1])
+		elif diversion.applied:
+			raise Exception("Diversion %s is still applied" % diversion)
+		elif database.is_layered(*key):
+			raise Exception("Diversion %s comes from a read-only layer" % diversion)
+
+	# Apply
+	for record in records:
+		if record["op"] in ("removed", "changed"):
+			database.remove(record["package"], record["source"])
+
+		if record["op"] in ("added", "changed"):
+			if (record["package"], record["source"]) in existing and record["op"] == "added":
+				# Already there
+				continue
+
+			new = record["new"]
+			database.add(
+				record["package"],
+				record["source"],
+				new["diversion"],
+				action=new["action"],
+				replacement=new["replacement"],
+				kind=new.get("kind", DiversionKind.FILE)
+			)
+
+	return len(records)
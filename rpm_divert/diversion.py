@@ -30,17 +30,25 @@
 A Diversion representation.
 """
 
-import logging
+import fnmatch
 
-import shutil
+import logging
 
 import os
 
+import stat
+
+from rpm_divert.backend import OS_BACKEND
+
+from rpm_divert.journal import Journal
+
 logger = logging.getLogger(__name__)
 
 __all__ = [
 	"DiversionAction",
-	"Diversion"
+	"DiversionKind",
+	"Diversion",
+	"PatternDiversion"
 ]
 
 class DiversionAction:
@@ -51,6 +59,17 @@ class DiversionAction:
 
 	COPY = "copy"
 
+class DiversionKind:
+
+	FILE = "file"
+
+	DIRECTORY = "directory"
+
+	PATTERN = "pattern"
+
+# Used when no journal has been supplied
+NO_JOURNAL = Journal(None)
+
 class ApplyActionException(Exception):
 	pass
 
@@ -65,11 +84,16 @@ class Diversion:
 				"diversion" : "/usr/bin/hello-diverted",
 				"action" : "symlink",
 				"replacement" : "/usr/lib/hello-custom/hello",
-				"applied" : true
+				"kind" : "file",
+				"applied" : true,
+				"fingerprint" : [
+					[1234, 1522838400000000000, 16, "/usr/lib/hello-custom/hello"],
+					[5678, 1522752000000000000, 10176, null]
+				]
 			}
 	"""
 
-	def __init__(self, source, diversion, action=DiversionAction.NOTHING, replacement=None, applied=False):
+	def __init__(self, source, diversion, action=DiversionAction.NOTHING, replacement=None, kind=DiversionKind.FILE, applied=False, fingerprint=None):
 		"""
 		Initialises the class.
 
@@ -77,14 +101,24 @@ class Diversion:
 		:param: diversion: the path of the diverted source
 		:param: action: the action to take
 		:param: replacement: the replacement file
+		:param: kind: the DiversionKind. Directory diversions move the
+		whole source tree at once, and replace it with the replacement
+		directory.
 		:param: applied: the diversion status
+		:param: fingerprint: the filesystem state recorded after the last
+		operation, as returned by stat_fingerprint()
 		"""
 
 		self.source = source
 		self.diversion = diversion
 		self.action = action
 		self.replacement = replacement
+		self.kind = kind
 		self.applied = applied
+		self.fingerprint = fingerprint
+
+		# The PatternDiversion this diversion has been expanded from
+		self.parent = None
 
 	@classmethod
 	def new_from_dict(cls, diversion_dict):
@@ -95,69 +129,330 @@ class Diversion:
 		:returns: a valid Diversion() object.
 		"""
 
+		if diversion_dict.get("kind") == DiversionKind.PATTERN:
+			cls = PatternDiversion
+
 		return cls(
 			diversion_dict.pop("source"),
 			diversion_dict.pop("diversion"),
 			**diversion_dict
 		)
 
-	def apply(self, create_directory=False):
+	@staticmethod
+	def _path_fingerprint(backend, path):
+		"""
+		Returns the fingerprint of a single path, without following
+		symlinks.
+
+		:param: backend: the filesystem backend
+		:param: path: the path to inspect
+		:returns: a [inode, mtime, size, link target] list, or None if
+		path doesn't exist
+		"""
+
+		try:
+			st = backend.lstat(path)
+		except FileNotFoundError:
+			return None
+
+		return [
+			st.st_ino,
+			st.st_mtime_ns,
+			st.st_size,
+			backend.readlink(path) if stat.S_ISLNK(st.st_mode) else None
+		]
+
+	def host_paths(self, root=None, backend=None):
+		"""
+		Returns the paths of the diversion on the host filesystem.
+
+		Symlinks in the source and diversion paths are followed except
+		for the last component, the replacement is fully resolved.
+
+		:param: root: the root directory the diversion lives in. If None,
+		paths are returned as-is.
+		:param: backend: the filesystem backend. Defaults to None (the
+		host filesystem).
+		:returns: a (source, diversion, replacement) tuple
+		"""
+
+		backend = backend or OS_BACKEND
+
+		return (
+			backend.resolve(root, self.source, follow=False),
+			backend.resolve(root, self.diversion, follow=False),
+			backend.resolve(root, self.replacement) if self.replacement is not None else None
+		)
+
+	def stat_fingerprint(self, root=None, backend=None):
+		"""
+		Returns the current fingerprint of the source and the diversion.
+
+		:param: root: the root directory the diversion lives in
+		:param: backend: the filesystem backend. Defaults to None (the
+		host filesystem).
+		:returns: a list containing the source and the diversion
+		fingerprints
+		"""
+
+		backend = backend or OS_BACKEND
+
+		source, diversion, replacement = self.host_paths(root, backend)
+
+		return [
+			self._path_fingerprint(backend, source),
+			self._path_fingerprint(backend, diversion)
+		]
+
+	def drifted(self, root=None, backend=None):
+		"""
+		:param: root: the root directory the diversion lives in
+		:param: backend: the filesystem backend. Defaults to None (the
+		host filesystem).
+		:returns: True if the filesystem changed since the last operation
+		(or if it has never been recorded), False otherwise.
+		"""
+
+		return self.fingerprint is None or self.fingerprint != self.stat_fingerprint(root, backend)
+
+	def _replacement_in_place(self, backend, source, replacement):
+		"""
+		:param: backend: the filesystem backend
+		:param: source: the host path of the source
+		:param: replacement: the host path of the replacement
+		:returns: True if the source currently is what apply() put there.
+		"""
+
+		if self.action == DiversionAction.SYMLINK:
+			return backend.islink(source) and backend.readlink(source) == self.replacement
+		elif self.action == DiversionAction.COPY and self.kind == DiversionKind.DIRECTORY:
+			return not backend.islink(source) and backend.same_tree(source, replacement)
+		elif self.action == DiversionAction.COPY:
+			return not backend.islink(source) and backend.same_content(source, replacement)
+
+		# DiversionAction.NOTHING: nothing should be there
+		return False
+
+	def _place_replacement(self, journal, source, diversion, replacement):
+		"""
+		Creates the replacement at the given path.
+
+		:param: journal: the Journal() to record the steps into
+		:param: source: the host path to create the replacement at
+		:param: diversion: the host path of the original file, whose
+		permission bits are copied to symlink replacements
+		:param: replacement: the host path of the replacement
+		"""
+
+		if self.action == DiversionAction.SYMLINK:
+			# Handle symlink action. The link target is kept as seen
+			# from inside the root.
+			# TODO: check replacement's existence
+			logger.info("symlinking \"%s\" to \"%s\"", self.replacement, source)
+			journal.run("symlink", self.replacement, source, undo=["remove", source])
+
+			# Copy permission bits
+			journal.run("copymode", diversion, replacement)
+		elif self.action == DiversionAction.COPY:
+			# Handle copy action
+			# TODO: check replacement's existence
+			logger.info("copying \"%s\" to \"%s\"", replacement, source)
+			if self.kind == DiversionKind.DIRECTORY:
+				journal.run("copytree", replacement, source, undo=["rmtree", source])
+			else:
+				journal.run("copy", replacement, source, undo=["remove", source])
+
+	def _remove(self, journal, path, undo=None):
+		"""
+		Removes a file, or a whole directory tree.
+
+		:param: journal: the Journal() to record the step into
+		:param: path: the host path to remove
+		:param: undo: the step that reverts the removal, or None
+		"""
+
+		if journal.backend.isdir(path) and not journal.backend.islink(path):
+			journal.run("rmtree", path, undo=undo)
+		else:
+			journal.run("remove", path, undo=undo)
+
+	def _replacement_undo(self, path, replacement):
+		"""
+		:param: path: the host path of a replacement
+		:param: replacement: the host path of the replacement source
+		:returns: the journal step that recreates the replacement at path
+		"""
+
+		if self.action == DiversionAction.SYMLINK:
+			return ["symlink", self.replacement, path]
+
+		return [
+			"copytree" if self.kind == DiversionKind.DIRECTORY else "copy",
+			replacement,
+			path
+		]
+
+	@staticmethod
+	def _rename(journal, src, dst):
+		"""
+		Renames src to dst, without ever replacing dst when renameat2()
+		is supported.
+
+		:param: journal: the Journal() to record the step into
+		:param: src: the host path to rename
+		:param: dst: the new host path
+		"""
+
+		journal.run(
+			"rename_noreplace" if journal.backend.supports_renameat2(os.path.dirname(src)) else "rename",
+			src,
+			dst,
+			undo=["rename", dst, src]
+		)
+
+	@staticmethod
+	def _exchange(journal, a, b):
+		"""
+		Atomically swaps two paths.
+
+		:param: journal: the Journal() to record the step into
+		:param: a: the first host path
+		:param: b: the second host path
+		"""
+
+		journal.run("exchange", a, b, journal.backend.lstat(a).st_ino, undo=["exchange", a, b])
+
+	def _keeps_replacement(self):
+		"""
+		:returns: True if unapply() can keep the replacement aside for the
+		next apply(), i.e. for file copies not tracked by a pattern.
+		"""
+
+		return (
+			self.action == DiversionAction.COPY and
+			self.kind == DiversionKind.FILE and
+			self.parent is None
+		)
+
+	def forget(self, journal=None, root=None):
+		"""
+		Removes the replacement kept aside by unapply(), if any (e.g.
+		because the apply() it was kept for failed). To be called on
+		unapplied diversions that are being removed.
+
+		:params: journal: the Journal() to record the steps into.
+		Defaults to None (no journal).
+		:params: root: the root directory the diversion lives in.
+		Defaults to None (the running system).
+		"""
+
+		journal = journal or NO_JOURNAL
+
+		if self.applied or not self._keeps_replacement():
+			return
+
+		staging = self._staging_path(self.host_paths(root, journal.backend)[0])
+
+		if journal.backend.lexists(staging):
+			logger.info("removing kept replacement \"%s\"", staging)
+
+			journal.begin("unapply", self)
+			journal.run("remove", staging)
+			journal.end("unapply", self)
+
+	@staticmethod
+	def _staging_path(source):
+		"""
+		:param: source: the host path of the source
+		:returns: the host path replacements are prepared at before being
+		swapped in
+		"""
+
+		directory, name = os.path.split(source)
+
+		return os.path.join(directory, ".%s.rpm-divert-new" % name)
+
+	def apply(self, create_directory=False, journal=None, root=None):
 		"""
 		Applies the diversion.
 
 		:params: create_directory: if True, creates the directory tree
 		of the diversion if it doesn't exist. Defaults to False.
+		:params: journal: the Journal() to record the steps into.
+		Defaults to None (no journal).
+		:params: root: the root directory the diversion lives in.
+		Defaults to None (the running system).
 		"""
 
+		journal = journal or NO_JOURNAL
+		fs = journal.backend
+
 		if self.applied:
 			return
 
-		diversion_dir = os.path.dirname(self.diversion)
+		source, diversion, replacement = self.host_paths(root, fs)
 
-		logger.info("diverting \"%s\" to \"%s\"" % (self.source, self.diversion))
+		diversion_dir = os.path.dirname(diversion)
+
+		logger.info("diverting \"%s\" to \"%s\"", source, diversion)
 
 		# Create directory tree if we should
-		if create_directory and not os.path.exists(diversion_dir):
-			os.makedirs(diversion_dir)
+		if create_directory and not fs.exists(diversion_dir):
+			fs.makedirs(diversion_dir)
 
 		# Safety checks
 		if False in (
-			os.path.exists(self.source),
-			not os.path.exists(self.diversion),
-			os.path.isdir(diversion_dir)
+			fs.lexists(source),
+			not fs.lexists(diversion),
+			fs.isdir(diversion_dir),
+			self.kind != DiversionKind.DIRECTORY or (fs.isdir(source) and not fs.islink(source))
 		):
 			raise ApplyActionException("Unable to apply diversion, safety checks failed")
 
 		try:
-			os.rename(self.source, self.diversion)
-
-			if self.action == DiversionAction.SYMLINK:
-				# Handle symlink action
-				# TODO: check replacement's existence
-				logger.info("symlinking \"%s\" to \"%s\"" % (self.replacement, self.source))
-				os.symlink(self.replacement, self.source)
-
-				# Copy permission bits
-				shutil.copymode(self.diversion, self.source)
-			elif self.action == DiversionAction.COPY:
-				# Handle copy action
-				# TODO: check replacement's existence
-				logger.info("copying \"%s\" to \"%s\"" % (self.replacement, self.source))
-				shutil.copy2(self.replacement, self.source)
+			journal.begin("apply", self)
+
+			if self.action != DiversionAction.NOTHING and fs.supports_renameat2(os.path.dirname(source)):
+				# Prepare the replacement next to the source and swap
+				# them, so that the source path never goes missing
+				staging = self._staging_path(source)
+
+				self._place_replacement(journal, staging, source, replacement)
+				self._exchange(journal, staging, source)
+				self._rename(journal, staging, diversion)
+			else:
+				self._rename(journal, source, diversion)
+				self._place_replacement(journal, source, diversion, replacement)
+
+			journal.end("apply", self)
 		except:
 			raise ApplyActionException("Unable to apply diversion")
 
 		self.applied = True
+		self.fingerprint = self.stat_fingerprint(root, fs)
 
-	def unapply(self):
+	def unapply(self, journal=None, root=None, keep_replacement=False):
 		"""
 		Unapplies the diversion.
+
+		:params: journal: the Journal() to record the steps into.
+		Defaults to None (no journal).
+		:params: root: the root directory the diversion lives in.
+		Defaults to None (the running system).
+		:params: keep_replacement: if True, a copied replacement is kept
+		aside for an apply() coming right after, which then doesn't have
+		to copy it again. Defaults to False.
 		"""
 
+		journal = journal or NO_JOURNAL
+		fs = journal.backend
+
 		if not self.applied:
 			return
 
-		logger.info("restoring diversion \"%s\" to \"%s\"" % (self.source, self.diversion))
+		source, diversion, replacement = self.host_paths(root, fs)
+
+		logger.info("restoring diversion \"%s\" to \"%s\"", source, diversion)
 
 		# Special case for DiversionAction.NOTHING:
 		#
@@ -172,39 +467,116 @@ class Diversion:
 		# Handle this special case by removing the previously diverted
 		# files while not touching the new ones.
 		if self.action == DiversionAction.NOTHING and not False in (
-			os.path.exists(self.source),
-			os.path.exists(self.diversion)
+			fs.lexists(source),
+			fs.lexists(diversion)
 		):
 			logger.warning("Diversion source already exists, removing old diversion and marking as unapplied")
 
 			try:
-				os.remove(self.diversion)
+				journal.begin("unapply", self)
+				self._remove(journal, diversion)
+				journal.end("unapply", self)
 			except:
 				raise UnapplyActionException("Unable to unapply diversion")
 			else:
 				self.applied = False
+				self.fingerprint = self.stat_fingerprint(root, fs)
 
 			return
 
 		# Safety checks
 		if False in (
-			(not os.path.exists(self.source) if self.action == DiversionAction.NOTHING else os.path.exists(self.source)),
-			os.path.exists(self.diversion),
+			(not fs.lexists(source) if self.action == DiversionAction.NOTHING else fs.lexists(source)),
+			fs.lexists(diversion),
 		):
 			raise UnapplyActionException("Unable to unapply diversion, safety checks failed")
 
 		try:
-			if self.action in (DiversionAction.SYMLINK, DiversionAction.COPY):
+			journal.begin("unapply", self)
+
+			if self.action == DiversionAction.NOTHING:
+				self._rename(journal, diversion, source)
+			elif fs.supports_renameat2(os.path.dirname(source)):
+				# Swap the original back in first, so that the source
+				# path never goes missing
+				self._exchange(journal, diversion, source)
+
+				if keep_replacement and self._keeps_replacement():
+					# Keep the copy where the next apply() prepares the
+					# replacement, which then only has to check that
+					# it is still up to date
+					staging = self._staging_path(source)
+
+					logger.info("keeping replacement \"%s\" as \"%s\"", diversion, staging)
+					journal.run("rename", diversion, staging, undo=["rename", staging, diversion])
+				else:
+					logger.info("removing replacement \"%s\"", diversion)
+					self._remove(journal, diversion, undo=self._replacement_undo(diversion, replacement))
+			else:
 				# Handle symlink and copy actions
-				logger.info("removing replacement \"%s\"" % self.source)
-				os.remove(self.source)
+				logger.info("removing replacement \"%s\"", source)
+				self._remove(journal, source, undo=self._replacement_undo(source, replacement))
 
-			os.rename(self.diversion, self.source)
+				self._rename(journal, diversion, source)
 
+			journal.end("unapply", self)
 		except:
 			raise UnapplyActionException("Unable to unapply diversion")
 
 		self.applied = False
+		self.fingerprint = self.stat_fingerprint(root, fs)
+
+	def reconcile(self, journal=None, root=None):
+		"""
+		Brings the filesystem back to the recorded diversion state, if
+		it drifted since the last operation.
+
+		An applied diversion whose source has been replaced (e.g. by a
+		package reinstall) gets the new file moved over the diversion and
+		the replacement put back in place.
+
+		:params: journal: the Journal() to record the steps into.
+		Defaults to None (no journal).
+		:params: root: the root directory the diversion lives in.
+		Defaults to None (the running system).
+		:returns: True if the diversion had drifted, False otherwise.
+		"""
+
+		journal = journal or NO_JOURNAL
+		fs = journal.backend
+
+		if not self.drifted(root, fs):
+			return False
+
+		source, diversion, replacement = self.host_paths(root, fs)
+
+		if self.applied:
+			if not fs.lexists(diversion):
+				logger.warning("diversion \"%s\" is missing, unable to reconcile \"%s\"", diversion, source)
+				return True
+
+			try:
+				journal.begin("reconcile", self)
+
+				if fs.lexists(source) and not self._replacement_in_place(fs, source, replacement):
+					# The source has been reinstalled, it is the new
+					# file to divert. The old diversion is overwritten.
+					logger.info("re-diverting \"%s\" to \"%s\"", source, diversion)
+					if self.kind == DiversionKind.DIRECTORY:
+						# rename() can't replace a non-empty directory
+						self._remove(journal, diversion)
+					journal.run("rename", source, diversion)
+
+				if self.action != DiversionAction.NOTHING and not fs.lexists(source):
+					self._place_replacement(journal, source, diversion, replacement)
+
+				journal.end("reconcile", self)
+			except:
+				raise ApplyActionException("Unable to reconcile diversion")
+
+		self.fingerprint = self.stat_fingerprint(root, fs)
+
+		return True
 
 	def dump(self):
 		"""
@@ -218,9 +590,49 @@ class Diversion:
 			"diversion" : self.diversion,
 			"action" : self.action,
 			"replacement" : self.replacement,
-			"applied" : self.applied
+			"kind" : self.kind,
+			"applied" : self.applied,
+			"fingerprint" : self.fingerprint
 		}
 
+	def pack(self):
+		"""
+		Packs the diversion in a compact tuple, suitable for marshal.
+
+		:returns: a tuple containing the diversion.
+		"""
+
+		return (
+			self.source,
+			self.diversion,
+			self.action,
+			self.replacement,
+			self.kind,
+			self.applied,
+			self.fingerprint
+		)
+
+	@classmethod
+	def unpack(cls, packed):
+		"""
+		Creates a new diversion from a tuple returned by pack().
+
+		:param: packed: the tuple to unpack
+		:returns: a valid Diversion() object.
+		"""
+
+		if packed[4] == DiversionKind.PATTERN:
+			return PatternDiversion.unpack(packed)
+
+		return cls(*packed)
+
+	def leaves(self):
+		"""
+		:returns: the list of the actual, concrete, diversions.
+		"""
+
+		return [self]
+
 	def __hash__(self):
 		"""
 		:returns: the hash of the object.
@@ -241,3 +653,252 @@ class Diversion:
 		"""
 
 		return "<Diversion: \"%s\" -> \"%s\">" % (self.source, self.diversion)
+
+class PatternDiversion(Diversion):
+
+	"""
+			{
+				"source" : "/usr/lib/libfoo.so.*",
+				"diversion" : "{name}-diverted",
+				"action" : "nothing",
+				"replacement" : null,
+				"kind" : "pattern",
+				"applied" : true,
+				"fingerprint" : null,
+				"expanded" : [
+					{
+						"source" : "/usr/lib/libfoo.so.1",
+						"diversion" : "/usr/lib/libfoo.so.1-diverted",
+						[...]
+					}
+				]
+			}
+
+	The source basename is a shell-style pattern, and the diversion (and
+	the replacement, if any) a template where {name} is replaced by the
+	basename of each match. A relative diversion is taken as relative to
+	the directory of the match.
+
+	Patterns are expanded at apply time, and every match is tracked as a
+	regular Diversion.
+	"""
+
+	def __init__(self, source, diversion, action=DiversionAction.NOTHING, replacement=None, kind=DiversionKind.PATTERN, applied=False, fingerprint=None, expanded=[]):
+		"""
+		Initialises the class.
+
+		:param: source: the source pattern
+		:param: diversion: the diversion template
+		:param: action: the action to take
+		:param: replacement: the replacement template
+		:param: kind: ignored, always DiversionKind.PATTERN
+		:param: applied: True if matches should be diverted
+		:param: fingerprint: ignored, matches have their own
+		:param: expanded: the tracked matches, as a list of dictionaries
+		"""
+
+		super().__init__(
+			source,
+			diversion,
+			action=action,
+			replacement=replacement,
+			kind=DiversionKind.PATTERN,
+			applied=applied
+		)
+
+		self.expanded = {}
+
+		for diversion_dict in expanded:
+			child = Diversion.new_from_dict(dict(diversion_dict))
+			child.parent = self
+			self.expanded[child.source] = child
+
+	def track(self, source):
+		"""
+		Starts tracking a match.
+
+		:param: source: the path (inside the root) of the match
+		:returns: the Diversion() of the match
+		"""
+
+		if source in self.expanded:
+			return self.expanded[source]
+
+		directory, name = os.path.split(source)
+
+		child = Diversion(
+			source,
+			os.path.join(directory, self.diversion.format(name=name)),
+			action=self.action,
+			replacement=(
+				self.replacement.format(name=name)
+				if self.replacement is not None
+				else None
+			)
+		)
+		child.parent = self
+
+		self.expanded[source] = child
+
+		return child
+
+	def expand(self, root=None, backend=None):
+		"""
+		Looks for new matches, with a single directory scan.
+
+		Entries that look like diversions of other matches are skipped.
+
+		:param: root: the root directory the diversion lives in
+		:param: backend: the filesystem backend. Defaults to None (the
+		host filesystem).
+		:returns: the list of the matching, not yet tracked, paths (as
+		seen from inside the root)
+		"""
+
+		directory, pattern = os.path.split(self.source)
+		diversion_pattern = self.diversion.format(name=pattern)
+
+		diverted = set(
+			child.diversion
+			for child in self.expanded.values()
+		)
+
+		backend = backend or OS_BACKEND
+
+		try:
+			names = backend.listdir(backend.resolve(root, directory))
+		except FileNotFoundError:
+			return []
+
+		return [
+			os.path.join(directory, name)
+			for name in names
+			if fnmatch.fnmatchcase(name, pattern)
+			and not fnmatch.fnmatchcase(os.path.join(directory, name), os.path.join(directory, diversion_pattern))
+			and not os.path.join(directory, name) in self.expanded
+			and not os.path.join(directory, name) in diverted
+		]
+
+	def apply(self, create_directory=False, journal=None, root=None):
+		"""
+		Applies the diversion on every match, old and new.
+
+		:params: create_directory: if True, creates the directory tree
+		of the diversions if it doesn't exist. Defaults to False.
+		:params: journal: the Journal() to record the steps into.
+		Defaults to None (no journal).
+		:params: root: the root directory the diversion lives in.
+		Defaults to None (the running system).
+		"""
+
+		for source in self.expand(root, (journal or NO_JOURNAL).backend):
+			self.track(source)
+
+		for child in list(self.expanded.values()):
+			child.apply(create_directory=create_directory, journal=journal, root=root)
+
+		self.applied = True
+
+	def unapply(self, journal=None, root=None, keep_replacement=False):
+		"""
+		Unapplies the diversion on every match, and stops tracking them.
+
+		:params: journal: the Journal() to record the steps into.
+		Defaults to None (no journal).
+		:params: root: the root directory the diversion lives in.
+		Defaults to None (the running system).
+		:params: keep_replacement: ignored, matches are not tracked
+		anymore.
+		"""
+
+		for source, child in list(self.expanded.items()):
+			child.unapply(journal=journal, root=root)
+			del self.expanded[source]
+
+		self.applied = False
+
+	def reconcile(self, journal=None, root=None):
+		"""
+		Reconciles every match, and diverts the new ones if the
+		diversion is applied.
+
+		:params: journal: the Journal() to record the steps into.
+		Defaults to None (no journal).
+		:params: root: the root directory the diversion lives in.
+		Defaults to None (the running system).
+		:returns: True if something had drifted, False otherwise.
+		"""
+
+		drifted = False
+
+		for child in list(self.expanded.values()):
+			if child.reconcile(journal=journal, root=root):
+				drifted = True
+
+		if self.applied and self.expand(root, (journal or NO_JOURNAL).backend):
+			self.apply(journal=journal, root=root)
+			drifted = True
+
+		return drifted
+
+	def dump(self):
+		"""
+		Dumps the diversion as a dictionary.
+
+		:returns: a dictionary containing the diversion, and its
+		matches.
+		"""
+
+		dump = super().dump()
+		dump["expanded"] = [
+			child.dump()
+			for source, child in sorted(self.expanded.items())
+		]
+
+		return dump
+
+	def pack(self):
+		"""
+		Packs the diversion, and its matches, in a compact tuple.
+
+		:returns: a tuple containing the diversion.
+		"""
+
+		return super().pack() + (
+			tuple(
+				child.pack()
+				for child in self.expanded.values()
+			),
+		)
+
+	@classmethod
+	def unpack(cls, packed):
+		"""
+		Creates a new pattern diversion from a tuple returned by pack().
+
+		:param: packed: the tuple to unpack
+		:returns: a valid PatternDiversion() object.
+		"""
+
+		pattern = cls(*packed[:7])
+
+		for child_packed in packed[7]:
+			child = Diversion.unpack(child_packed)
+			child.parent = pattern
+			pattern.expanded[child.source] = child
+
+		return pattern
+
+	def leaves(self):
+		"""
+		:returns: the list of the tracked matches.
+		"""
+
+		return list(self.expanded.values())
+
+	def __repr__(self):
+		"""
+		:returns: a representation of the object.
+		"""
+
+		return "<PatternDiversion: \"%s\" -> \"%s\">" % (self.source, self.diversion)
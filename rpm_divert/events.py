@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+#
+# rpm-divert
+# Copyright (C) 2018 Eugenio "g7" Paolantonio
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of the <organization> nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Progress events of apply and unapply.
+
+Database.apply() and Database.unapply() report to an Observer():
+
+ - plan_ready(operation, diversions), once the diversions to process are
+   known;
+ - op_start(operation, package, diversion), before each of them;
+ - op_done(operation, package, diversion, size, duration), with the bytes
+   copied and the seconds taken;
+ - op_failed(operation, package, diversion, error, duration), before the
+   error is raised.
+"""
+
+import json
+
+import sys
+
+import time
+
+__all__ = [
+	"Observer",
+	"ObserverGroup",
+	"JSONEvents",
+	"ProgressRenderer",
+	"EVENT_FORMATS",
+	"create_observer"
+]
+
+EVENT_FORMATS = ("json",)
+
+class Observer:
+
+	"""
+	Receives the progress of apply and unapply. Every event is ignored
+	by default, subclasses override the ones they are interested in.
+	"""
+
+	def plan_ready(self, operation, diversions):
+		"""
+		:param: operation: "apply" or "unapply"
+		:param: diversions: the list of (package name, Diversion) tuples
+		about to be processed
+		"""
+
+		pass
+
+	def op_start(self, operation, package, diversion):
+		"""
+		:param: operation: "apply" or "unapply"
+		:param: package: the package name
+		:param: diversion: the Diversion() about to be processed
+		"""
+
+		pass
+
+	def op_done(self, operation, package, diversion, size, duration):
+		"""
+		:param: operation: "apply" or "unapply"
+		:param: package: the package name
+		:param: diversion: the processed Diversion()
+		:param: size: the number of bytes copied
+		:param: duration: the time taken, in seconds
+		"""
+
+		pass
+
+	def op_failed(self, operation, package, diversion, error, duration):
+		"""
+		:param: operation: "apply" or "unapply"
+		:param: package: the package name
+		:param: diversion: the Diversion() that failed
+		:param: error: the exception
+		:param: duration: the time taken, in seconds
+		"""
+
+		pass
+
+class ObserverGroup(Observer):
+
+	"""
+	Forwards every event to several observers.
+	"""
+
+	def __init__(self, observers):
+		"""
+		Initialises the class.
+
+		:param: observers: the list of Observer() objects
+		"""
+
+		self.observers = observers
+
+	def plan_ready(self, *args):
+		for observer in self.observers:
+			observer.plan_ready(*args)
+
+	def op_start(self, *args):
+		for observer in self.observers:
+			observer.op_start(*args)
+
+	def op_done(self, *args):
+		for observer in self.observers:
+			observer.op_done(*args)
+
+	def op_failed(self, *args):
+		for observer in self.observers:
+			observer.op_failed(*args)
+
+class JSONEvents(Observer):
+
+	"""
+	Writes every event as a JSON object on its own line:
+
+		{"event": "plan-ready", "operation": "apply", "total": 2}
+		{"event": "op-start", "operation": "apply", "package": "custom-hello", "source": "/usr/bin/hello"}
+		{"event": "op-done", "operation": "apply", "package": "custom-hello", "source": "/usr/bin/hello", "bytes": 0, "duration": 0.0004}
+	"""
+
+	def __init__(self, stream=None):
+		"""
+		Initialises the class.
+
+		:param: stream: the stream to write to. Defaults to stdout,
+		which (unlike stderr) isn't shared with the log messages.
+		"""
+
+		self.stream = stream or sys.stdout
+
+	def _write(self, event, **fields):
+		"""
+		Writes an event.
+
+		:param: event: the event name
+		:param: fields: the event fields
+		"""
+
+		fields["event"] = event
+
+		self.stream.write(json.dumps(fields, sort_keys=True) + "\n")
+		self.stream.flush()
+
+	def plan_ready(self, operation, diversions):
+		self._write("plan-ready", operation=operation, total=len(diversions))
+
+	def op_start(self, operation, package, diversion):
+		self._write("op-start", operation=operation, package=package, source=diversion.source)
+
+	def op_done(self, operation, package, diversion, size, duration):
+		self._write("op-done", operation=operation, package=package, source=diversion.source, bytes=size, duration=duration)
+
+	def op_failed(self, operation, package, diversion, error, duration):
+		self._write("op-failed", operation=operation, package=package, source=diversion.source, error=str(error), duration=duration)
+
+class ProgressRenderer(Observer):
+
+	"""
+	Draws a progress line, with totals, rate and ETA.
+	"""
+
+	# Seconds between redraws
+	INTERVAL = 0.1
+
+	def __init__(self, stream=None):
+		"""
+		Initialises the class.
+
+		:param: stream: the stream to draw on. Defaults to stderr.
+		"""
+
+		self.stream = stream or sys.stderr
+
+		self.total = 0
+		self.done = 0
+		self.failed = 0
+		self.size = 0
+		self.started = None
+		self.drawn = 0
+
+	def _draw(self, operation, force=False):
+		"""
+		Redraws the progress line, at most every INTERVAL seconds.
+
+		:param: operation: the operation name
+		:param: force: if True, redraws anyway and ends the line
+		"""
+
+		now = time.monotonic()
+
+		if not force and now - self.drawn < self.INTERVAL:
+			return
+
+		self.drawn = now
+
+		elapsed = max(now - self.started, 1e-6)
+		processed = self.done + self.failed
+		rate = processed / elapsed
+
+		self.stream.write(
+			"\r%s: %d/%d (%d%%), %d failed, %.1f MiB, %.1f/s, ETA %ds%s" % (
+				operation,
+				processed,
+				self.total,
+				processed * 100 // max(self.total, 1),
+				self.failed,
+				self.size / 1024 / 1024,
+				rate,
+				(self.total - processed) / rate if rate else 0,
+				"\n" if force else ""
+			)
+		)
+		self.stream.flush()
+
+	def plan_ready(self, operation, diversions):
+		self.total = len(diversions)
+		self.started = time.monotonic()
+
+		if not diversions:
+			self._draw(operation, force=True)
+
+	def op_done(self, operation, package, diversion, size, duration):
+		self.done += 1
+		self.size += size
+
+		self._draw(operation, force=self.done + self.failed == self.total)
+
+	def op_failed(self, operation, package, diversion, error, duration):
+		self.failed += 1
+
+		# The operation stops here
+		self._draw(operation, force=True)
+
+def create_observer(progress=False, events=None):
+	"""
+	Creates the observer requested on the command line.
+
+	:param: progress: if True, draws a progress line on stderr
+	:param: events: the format of the event stream to write on stdout
+	(one of EVENT_FORMATS), or None
+	:returns: an Observer(), or None if nothing has been requested
+	"""
+
+	observers = []
+
+	if progress:
+		observers.append(ProgressRenderer())
+
+	if events == "json":
+		observers.append(JSONEvents())
+
+	if not observers:
+		return None
+	elif len(observers) == 1:
+		return observers[0]
+
+	return ObserverGroup(observers)
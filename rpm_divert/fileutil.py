@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+#
+# rpm-divert
+# Copyright (C) 2018 Eugenio "g7" Paolantonio
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of the <organization> nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+File helpers.
+"""
+
+import ctypes
+
+import errno
+
+import hashlib
+
+import logging
+
+import shutil
+
+import os
+
+import stat
+
+import tempfile
+
+__all__ = [
+	"same_content",
+	"same_tree",
+	"copy",
+	"copytree",
+	"renameat2",
+	"rename_noreplace",
+	"exchange",
+	"supports_renameat2"
+]
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+# From linux/fs.h
+AT_FDCWD = -100
+RENAME_NOREPLACE = 1
+RENAME_EXCHANGE = 2
+
+_renameat2 = None
+
+# st_dev -> whether renameat2() works there
+_renameat2_support = {}
+
+def _digest(path):
+	"""
+	Hashes a file, reading it in chunks.
+
+	:param: path: the file to hash
+	:returns: the digest
+	"""
+
+	digest = hashlib.blake2b()
+
+	with open(path, "rb") as f:
+		for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+			digest.update(chunk)
+
+	return digest.digest()
+
+def same_content(a, b):
+	"""
+	Checks whether two regular files have the same content.
+
+	Cheap checks come first: files with a different size differ, and
+	files with the same size and mtime (as left by copy()) are considered
+	equal. Only then the contents are hashed.
+
+	:param: a: the first file
+	:param: b: the second file
+	:returns: True if the files have the same content, False otherwise.
+	"""
+
+	try:
+		a_stat = os.stat(a)
+		b_stat = os.stat(b)
+	except FileNotFoundError:
+		return False
+
+	if not (stat.S_ISREG(a_stat.st_mode) and stat.S_ISREG(b_stat.st_mode)):
+		return False
+	elif a_stat.st_size != b_stat.st_size:
+		return False
+	elif (
+		(a_stat.st_dev, a_stat.st_ino) == (b_stat.st_dev, b_stat.st_ino) or
+		a_stat.st_mtime_ns == b_stat.st_mtime_ns
+	):
+		return True
+
+	return _digest(a) == _digest(b)
+
+def same_tree(a, b):
+	"""
+	Checks whether two directory trees have the same content.
+
+	:param: a: the first directory
+	:param: b: the second directory
+	:returns: True if both trees contain the same entries, and the same
+	content in their regular files. False otherwise.
+	"""
+
+	if not (os.path.isdir(a) and os.path.isdir(b)):
+		return False
+
+	for (a_root, a_dirs, a_files), (b_root, b_dirs, b_files) in zip(os.walk(a), os.walk(b)):
+		if os.path.relpath(a_root, a) != os.path.relpath(b_root, b):
+			return False
+
+		a_dirs.sort()
+		b_dirs.sort()
+
+		if a_dirs != b_dirs or sorted(a_files) != sorted(b_files):
+			return False
+
+		for name in a_files:
+			a_path = os.path.join(a_root, name)
+			b_path = os.path.join(b_root, name)
+
+			if os.path.islink(a_path) or os.path.islink(b_path):
+				if not (
+					os.path.islink(a_path) and os.path.islink(b_path) and
+					os.readlink(a_path) == os.readlink(b_path)
+				):
+					return False
+			elif not same_content(a_path, b_path):
+				return False
+
+	return True
+
+def copy(src, dst, throttle=None):
+	"""
+	Copies src to dst, along with its metadata, like shutil.copy2().
+
+	If dst is already a regular file with the same content, only the
+	metadata is copied.
+
+	:param: src: the source file
+	:param: dst: the destination file
+	:param: throttle: the Throttle() that accounts for (and, if it has
+	a byte limit, paces) the copied data. Defaults to None.
+	"""
+
+	if not os.path.islink(dst) and same_content(src, dst):
+		logger.debug("\"%s\" already matches \"%s\", not copying", dst, src)
+		shutil.copystat(src, dst)
+		return
+
+	if throttle is None:
+		shutil.copy2(src, dst)
+	elif not throttle.max_bytes_per_sec or os.path.islink(src):
+		shutil.copy2(src, dst)
+		throttle.transfer(os.lstat(dst).st_size)
+	else:
+		# Copy a chunk at a time, to be paced
+		if os.path.isdir(dst):
+			dst = os.path.join(dst, os.path.basename(src))
+
+		with open(src, "rb") as src_f, open(dst, "wb") as dst_f:
+			for chunk in iter(lambda: src_f.read(CHUNK_SIZE), b""):
+				dst_f.write(chunk)
+				throttle.transfer(len(chunk))
+
+		shutil.copystat(src, dst)
+
+def copytree(src, dst, throttle=None):
+	"""
+	Copies the src directory tree to dst, preserving symlinks and
+	metadata.
+
+	:param: src: the source directory
+	:param: dst: the destination directory, which must not exist
+	:param: throttle: the Throttle() every file is copied through.
+	Defaults to None.
+	"""
+
+	shutil.copytree(
+		src,
+		dst,
+		symlinks=True,
+		copy_function=lambda src, dst: copy(src, dst, throttle=throttle)
+	)
+
+def renameat2(src, dst, flags):
+	"""
+	Calls renameat2(2), through the C library.
+
+	:param: src: the source path
+	:param: dst: the destination path
+	:param: flags: RENAME_NOREPLACE or RENAME_EXCHANGE
+	"""
+
+	global _renameat2
+
+	if _renameat2 is None:
+		# Available since glibc 2.28
+		_renameat2 = getattr(ctypes.CDLL(None, use_errno=True), "renameat2", False)
+
+		if _renameat2:
+			_renameat2.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+			_renameat2.restype = ctypes.c_int
+
+	if not _renameat2:
+		raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS), src, None, dst)
+
+	if _renameat2(AT_FDCWD, os.fsencode(src), AT_FDCWD, os.fsencode(dst), flags) != 0:
+		error = ctypes.get_errno()
+		raise OSError(error, os.strerror(error), src, None, dst)
+
+def rename_noreplace(src, dst):
+	"""
+	Renames src to dst, failing if dst already exists.
+
+	:param: src: the source path
+	:param: dst: the destination path
+	"""
+
+	renameat2(src, dst, RENAME_NOREPLACE)
+
+def exchange(a, b, ino=None):
+	"""
+	Atomically swaps two paths.
+
+	:param: a: the first path
+	:param: b: the second path
+	:param: ino: unused, the inode of a, recorded by the journal to tell
+	whether the exchange happened
+	"""
+
+	renameat2(a, b, RENAME_EXCHANGE)
+
+def supports_renameat2(directory):
+	"""
+	Checks whether renameat2() with RENAME_EXCHANGE works on the
+	filesystem of the given directory. The result is cached per
+	filesystem.
+
+	:param: directory: the directory to probe
+	:returns: True if it is supported, False otherwise.
+	"""
+
+	try:
+		device = os.stat(directory).st_dev
+	except OSError:
+		return False
+
+	if not device in _renameat2_support:
+		probes = []
+
+		try:
+			for _ in range(2):
+				fd, path = tempfile.mkstemp(prefix=".rpm-divert-probe-", dir=directory)
+				os.close(fd)
+				probes.append(path)
+
+			exchange(*probes)
+			_renameat2_support[device] = True
+		except OSError:
+			_renameat2_support[device] = False
+		finally:
+			for path in probes:
+				os.remove(path)
+
+	return _renameat2_support[device]
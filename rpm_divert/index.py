@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+#
+# rpm-divert
+# Copyright (C) 2018 Eugenio "g7" Paolantonio
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of the <organization> nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+The diverted paths index lets other tools (RPM plugins, configuration
+management, backup exclusions...) check whether a path is diverted without
+parsing the database. It only needs the standard library: this module
+doesn't import anything else from rpm_divert, so it can be copied around.
+
+The file is meant to be mmap()'d and is laid out as follows (little
+endian):
+
+	header     "RPMDIDX\\0", version, count, bloom size (bytes), bloom hashes
+	bloom      optional Bloom filter of every path
+	table      count sorted fixed-size records: offset, length, flags
+	strings    the paths, UTF-8 encoded, in table order
+
+Lookups check the Bloom filter first and then bisect the table, reading
+only the strings they compare.
+"""
+
+import hashlib
+
+import mmap
+
+import os
+
+import struct
+
+import sys
+
+__all__ = [
+	"SOURCE",
+	"DIVERSION",
+	"APPLIED",
+	"write_index",
+	"DiversionIndex"
+]
+
+MAGIC = b"RPMDIDX\0"
+VERSION = 1
+
+HEADER = struct.Struct("<8sIIII")
+RECORD = struct.Struct("<III")
+
+# Record flags
+SOURCE = 1
+DIVERSION = 2
+APPLIED = 4
+
+def _bloom_bits(path, size, hashes):
+	"""
+	Yields the Bloom filter bits of a path, by double hashing.
+
+	:param: path: the encoded path
+	:param: size: the filter size, in bytes
+	:param: hashes: the number of bits per path
+	"""
+
+	digest = hashlib.blake2b(path, digest_size=16).digest()
+	h1 = int.from_bytes(digest[:8], "little")
+	h2 = int.from_bytes(digest[8:], "little") | 1
+
+	for i in range(hashes):
+		yield (h1 + i * h2) % (size * 8)
+
+def write_index(path, entries, bloom_bits_per_path=10):
+	"""
+	Writes an index, atomically.
+
+	:param: path: the index file
+	:param: entries: a dictionary of path -> flags
+	:param: bloom_bits_per_path: the Bloom filter bits for every path
+	(about 1% false positives with the default), 0 to leave the filter out
+	"""
+
+	# Only the order is kept, paths are encoded again on every pass
+	# rather than keeping an encoded copy of all of them. UTF-8 sorts
+	# like the code points.
+	paths = sorted(entries)
+
+	if bloom_bits_per_path and paths:
+		bloom_size = (len(paths) * bloom_bits_per_path + 7) // 8
+		bloom_hashes = max(1, round(bloom_bits_per_path * 0.69))
+	else:
+		bloom_size = bloom_hashes = 0
+
+	bloom = bytearray(bloom_size)
+	for _path in paths:
+		for bit in _bloom_bits(_path.encode("utf-8"), bloom_size, bloom_hashes):
+			bloom[bit >> 3] |= 1 << (bit & 7)
+
+	temporary_path = "%s.new" % path
+
+	with open(temporary_path, "wb") as f:
+		f.write(HEADER.pack(MAGIC, VERSION, len(paths), bloom_size, bloom_hashes))
+		f.write(bloom)
+
+		offset = HEADER.size + bloom_size + RECORD.size * len(paths)
+		for _path in paths:
+			length = len(_path.encode("utf-8"))
+			f.write(RECORD.pack(offset, length, entries[_path]))
+			offset += length
+
+		for _path in paths:
+			f.write(_path.encode("utf-8"))
+
+		f.flush()
+		os.fsync(f.fileno())
+
+	os.replace(temporary_path, path)
+
+class DiversionIndex:
+
+	"""
+	A read-only, memory-mapped index.
+	"""
+
+	def __init__(self, path):
+		"""
+		Initialises the class.
+
+		:param: path: the index file
+		"""
+
+		with open(path, "rb") as f:
+			self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+		magic, version, self.count, self._bloom_size, self._bloom_hashes = \
+			HEADER.unpack_from(self._map)
+
+		if magic != MAGIC or version != VERSION:
+			self.close()
+			raise ValueError("%s is not a supported diversion index" % path)
+
+		self._table = HEADER.size + self._bloom_size
+
+	def _record(self, position):
+		"""
+		:param: position: the record number
+		:returns: a (path, flags) tuple
+		"""
+
+		offset, length, flags = RECORD.unpack_from(
+			self._map, self._table + position * RECORD.size
+		)
+
+		return self._map[offset:offset + length], flags
+
+	def lookup(self, path):
+		"""
+		Looks a path up.
+
+		:param: path: the path to check, as stored in the database
+		:returns: the path flags (a combination of SOURCE, DIVERSION and
+		APPLIED), 0 if the path isn't in the index.
+		"""
+
+		if isinstance(path, str):
+			path = path.encode("utf-8")
+
+		if self._bloom_size:
+			for bit in _bloom_bits(path, self._bloom_size, self._bloom_hashes):
+				if not self._map[HEADER.size + (bit >> 3)] & (1 << (bit & 7)):
+					return 0
+
+		low, high = 0, self.count
+		while low < high:
+			middle = (low + high) // 2
+			candidate, flags = self._record(middle)
+
+			if candidate == path:
+				return flags
+			elif candidate < path:
+				low = middle + 1
+			else:
+				high = middle
+
+		return 0
+
+	def __contains__(self, path):
+		"""
+		:returns: True if the path is diverted (as a source or as a
+		diversion), False otherwise.
+		"""
+
+		return self.lookup(path) != 0
+
+	def __iter__(self):
+		"""
+		Yields (path, flags) tuples, sorted by path.
+		"""
+
+		for position in range(self.count):
+			path, flags = self._record(position)
+			yield path.decode("utf-8"), flags
+
+	def close(self):
+		"""
+		Unmaps the index.
+		"""
+
+		self._map.close()
+
+	def __enter__(self):
+		"""
+		:returns: this DiversionIndex() instance
+		"""
+
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		"""
+		Unmaps the index.
+		"""
+
+		self.close()
+
+if __name__ == "__main__":
+	# python3 index.py INDEX PATH...
+	# Exits with 0 if every PATH is diverted, 1 otherwise.
+	with DiversionIndex(sys.argv[1]) as index:
+		sys.exit(
+			0 if all(path in index for path in sys.argv[2:]) else 1
+		)
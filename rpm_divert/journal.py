@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+#
+# rpm-divert
+# Copyright (C) 2018 Eugenio "g7" Paolantonio
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of the <organization> nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+The operation journal records every filesystem step taken by apply and
+unapply, before and after it runs, so that an interrupted run can be
+recovered without auditing the whole database.
+
+It is a simple file of JSON records, one per line. The begin and step
+(intent) records are fsync'd before going on, the done and end ones ride
+on the next fsync, or on the database save:
+
+	{"begin": "apply", "source": "/usr/bin/hello", "parent": null, "applied": false}
+	{"step": "rename", "args": ["/usr/bin/hello", "/usr/bin/hello-diverted"], "undo": ["rename", "/usr/bin/hello-diverted", "/usr/bin/hello"]}
+	{"done": "rename"}
+	{"step": "symlink", "args": ["/usr/lib/hello-custom/hello", "/usr/bin/hello"], "undo": ["remove", "/usr/bin/hello"]}
+	{"done": "symlink"}
+	{"end": "apply", "source": "/usr/bin/hello"}
+
+The journal is cleared once the database has been saved.
+"""
+
+import json
+
+import logging
+
+import os
+
+from rpm_divert.backend import OS_BACKEND
+
+__all__ = [
+	"Journal"
+]
+
+logger = logging.getLogger(__name__)
+
+# step name -> check telling whether an unconfirmed step took effect. The
+# steps themselves are the methods of the same name of the backend.
+STEPS = {
+	"rename" : lambda fs, src, dst: not fs.lexists(src) and fs.lexists(dst),
+	"symlink" : lambda fs, target, path: fs.islink(path),
+	"copy" : lambda fs, src, dst: fs.lexists(dst),
+	"copymode" : lambda fs, src, dst: True,
+	"remove" : lambda fs, path: not fs.lexists(path),
+	"copytree" : lambda fs, src, dst: fs.lexists(dst),
+	"rmtree" : lambda fs, path: not fs.lexists(path),
+	"rename_noreplace" : lambda fs, src, dst: not fs.lexists(src) and fs.lexists(dst),
+	"exchange" : lambda fs, a, b, ino=None: ino is not None and fs.lexists(b) and fs.lstat(b).st_ino == ino,
+}
+
+# Steps that copy data, paced by the byte limit of a Throttle()
+COPY_STEPS = ("copy", "copytree")
+
+# Final diversion state of a completed operation
+FINAL_STATE = {
+	"apply" : lambda applied: True,
+	"unapply" : lambda applied: False,
+	"reconcile" : lambda applied: applied,
+}
+
+class Journal:
+
+	"""
+	An intent journal.
+	"""
+
+	def __init__(self, path, backend=None):
+		"""
+		Initialises the class.
+
+		:param: path: the journal path. If None, nothing is recorded.
+		:param: backend: the filesystem backend the steps are run on.
+		Defaults to None (the host filesystem).
+		"""
+
+		self.path = path
+		self.backend = backend or OS_BACKEND
+
+		# The Throttle() steps are run through, if any
+		self.throttle = None
+
+		self._fd = None
+
+	def _write(self, record, sync=True):
+		"""
+		Appends a record to the journal.
+
+		:param: record: the dictionary to append
+		:param: sync: if True (the default), the record is fsync'd.
+		Confirmations don't need to be, recover() checks whether an
+		unconfirmed step took effect anyway.
+		"""
+
+		if self.path is None:
+			return
+
+		if self._fd is None:
+			directory = os.path.dirname(self.path)
+
+			if not os.path.exists(directory):
+				os.makedirs(directory)
+
+			self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+		os.write(self._fd, (json.dumps(record) + "\n").encode("utf-8"))
+
+		if sync:
+			os.fsync(self._fd)
+
+	def begin(self, operation, diversion):
+		"""
+		Records the start of an operation.
+
+		:param: operation: the operation name ("apply", "unapply", ...)
+		:param: diversion: the Diversion() being processed
+		"""
+
+		self._write(
+			{
+				"begin" : operation,
+				"source" : diversion.source,
+				"parent" : diversion.parent.source if diversion.parent is not None else None,
+				"applied" : diversion.applied
+			}
+		)
+
+	def run(self, step, *args, undo=None):
+		"""
+		Runs a filesystem step, recording it before and after.
+
+		:param: step: the step name, a key of STEPS
+		:param: args: the step arguments
+		:param: undo: the step (as a [name, args...] list) that reverts
+		this one, or None if it can't be reverted
+		"""
+
+		self._write(
+			{
+				"step" : step,
+				"args" : args,
+				"undo" : undo
+			}
+		)
+
+		function = getattr(self.backend, step)
+
+		if self.throttle is None:
+			function(*args)
+		elif step in COPY_STEPS:
+			function(*args, throttle=self.throttle)
+		else:
+			self.throttle.operation()
+			function(*args)
+
+		self._write({"done" : step}, sync=False)
+
+	def end(self, operation, diversion):
+		"""
+		Records the completion of an operation.
+
+		:param: operation: the operation name
+		:param: diversion: the Diversion() that has been processed
+		"""
+
+		self._write(
+			{
+				"end" : operation,
+				"source" : diversion.source
+			},
+			sync=False
+		)
+
+	def pending(self):
+		"""
+		:returns: True if the journal contains unsaved operations, False
+		otherwise.
+		"""
+
+		return (
+			self.path is not None and
+			os.path.exists(self.path) and
+			os.path.getsize(self.path) > 0
+		)
+
+	def close(self):
+		"""
+		Closes the journal. Its records are kept.
+		"""
+
+		if self._fd is not None:
+			os.close(self._fd)
+			self._fd = None
+
+	def clear(self):
+		"""
+		Clears the journal. To be called once the database has been
+		saved.
+		"""
+
+		self.close()
+
+		if self.path is not None and os.path.exists(self.path):
+			os.remove(self.path)
+
+	def _read(self):
+		"""
+		Parses the journal.
+
+		:returns: a list of operations, each one a dictionary with the
+		begin record, the list of steps (with their "done" state) and
+		whether the operation ended.
+		"""
+
+		operations = []
+
+		with open(self.path, "r") as f:
+			for line in f:
+				try:
+					record = json.loads(line)
+				except ValueError:
+					# Torn last record
+					logger.warning("Ignoring malformed journal record")
+					break
+
+				if "begin" in record:
+					operations.append(
+						{
+							"begin" : record,
+							"steps" : [],
+							"ended" : False
+						}
+					)
+				elif "step" in record and operations:
+					record["done"] = False
+					operations[-1]["steps"].append(record)
+				elif "done" in record and operations and operations[-1]["steps"]:
+					operations[-1]["steps"][-1]["done"] = True
+				elif "end" in record and operations:
+					operations[-1]["ended"] = True
+
+		return operations
+
+	def recover(self, database, rollback=False):
+		"""
+		Recovers the operations recorded in the journal.
+
+		Completed operations are rolled forward, by updating the
+		diversion state in the database. The interrupted one is rolled
+		back by undoing its steps, unless it already went through an
+		irreversible one.
+
+		:param: database: the Database() to update
+		:param: rollback: if True, every operation is rolled back, in
+		reverse order. Defaults to False.
+		"""
+
+		operations = self._read()
+
+		if rollback:
+			operations.reverse()
+
+		if not operations:
+			return
+
+		diversions = {}
+		for pkg in database._packages.values():
+			for diversion in pkg.diversions:
+				diversions[diversion.source] = diversion
+				for leaf in diversion.leaves():
+					diversions[leaf.source] = leaf
+
+		for operation in operations:
+			begin = operation["begin"]
+			diversion = diversions.get(begin["source"])
+			if diversion is None and begin.get("parent") in diversions:
+				# A pattern match that has never been saved
+				diversion = diversions[begin["parent"]].track(begin["source"])
+				diversions[diversion.source] = diversion
+			completed = operation["ended"] and not rollback
+
+			if not completed:
+				effective = [
+					step
+					for step in operation["steps"]
+					if step["done"] or STEPS[step["step"]](self.backend, *step["args"])
+				]
+
+				if True in (
+					step["undo"] is None and step["step"] != "copymode"
+					for step in effective
+				):
+					# Can't go back, the operation is as good as done
+					logger.warning("%s of \"%s\" can't be rolled back", begin["begin"], begin["source"])
+					completed = True
+				else:
+					logger.warning("rolling back %s of \"%s\"", begin["begin"], begin["source"])
+
+					for step in reversed(effective):
+						if step["undo"] is None:
+							continue
+
+						undo, *args = step["undo"]
+						getattr(self.backend, undo)(*args)
+
+			if diversion is None:
+				continue
+
+			if completed:
+				diversion.applied = FINAL_STATE[begin["begin"]](begin["applied"])
+			else:
+				diversion.applied = begin["applied"]
+
+			# Let reconcile double check whatever has been left
+			diversion.fingerprint = diversion.stat_fingerprint(database.root, backend=self.backend) if operation["ended"] and not rollback else None
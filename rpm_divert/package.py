@@ -86,6 +86,38 @@ class Package:
 
 		return pkg
 
+	def pack(self):
+		"""
+		Packs the package in a compact tuple, suitable for marshal.
+
+		:returns: a tuple containing the package.
+		"""
+
+		return (
+			self.name,
+			tuple(
+				diversion.pack()
+				for diversion in self.diversions
+			)
+		)
+
+	@classmethod
+	def unpack(cls, packed):
+		"""
+		Creates a new package from a tuple returned by pack().
+
+		:param: packed: the tuple to unpack
+		:returns: a valid Package() object.
+		"""
+
+		pkg = cls(packed[0])
+		pkg.diversions.update(
+			Diversion.unpack(diversion)
+			for diversion in packed[1]
+		)
+
+		return pkg
+
 	def dump(self):
 		"""
 		Dumps the package as a dictionary.
@@ -97,7 +129,7 @@ class Package:
 			"package" : self.name,
 			"diversions" : [
 				diversion.dump()
-				for diversion in self.diversions
+				for diversion in sorted(self.diversions, key=lambda x: x.source)
 			]
 		}
 
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+#
+# rpm-divert
+# Copyright (C) 2018 Eugenio "g7" Paolantonio
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of the <organization> nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+The pending queue stores apply/unapply requests that have been deferred
+until the end of an RPM transaction.
+
+Every request is a JSON object on its own line, appended atomically to the
+queue file:
+
+	{"operation": "unapply", "package": "custom-hello", "source": null, "create_directory": false}
+
+The queue is then reduced to the net operation of each diversion and
+executed once by the flush command (usually from %posttrans).
+"""
+
+import json
+
+import logging
+
+import os
+
+from rpm_divert.diversion import DiversionKind
+
+__all__ = [
+	"PendingQueue"
+]
+
+logger = logging.getLogger(__name__)
+
+class PendingQueue:
+
+	"""
+	The pending operations queue.
+	"""
+
+	OPERATIONS = ("apply", "unapply")
+
+	def __init__(self, path):
+		"""
+		Initialises the class.
+
+		:param: path: the queue path
+		"""
+
+		self.path = path
+
+	@property
+	def flushing_path(self):
+		"""
+		:returns: the path the queue is moved to while being flushed.
+		"""
+
+		return "%s.flushing" % self.path
+
+	def append(self, operation, package=None, source=None, create_directory=False):
+		"""
+		Appends an operation to the queue.
+
+		:param: operation: either "apply" or "unapply"
+		:param: package: the package to process, or None for every package
+		:param: source: the diversion source to process, or None for every
+		diversion
+		:param: create_directory: passed as-is to Diversion.apply()
+		"""
+
+		if not operation in self.OPERATIONS:
+			raise Exception("Unknown operation %s" % operation)
+
+		directory = os.path.dirname(self.path)
+
+		if not os.path.exists(directory):
+			os.makedirs(directory)
+
+		line = json.dumps(
+			{
+				"operation" : operation,
+				"package" : package,
+				"source" : source,
+				"create_directory" : create_directory
+			},
+			sort_keys=True
+		) + "\n"
+
+		# A single write() on an O_APPEND descriptor, so that concurrent
+		# triggers never interleave their entries
+		fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+		try:
+			os.write(fd, line.encode("utf-8"))
+		finally:
+			os.close(fd)
+
+	def take(self):
+		"""
+		Moves the queue away so that new requests start a fresh one,
+		and returns its entries.
+
+		Entries left over by a previously failed flush are returned first.
+
+		:returns: a list of dictionaries, in the order they were queued
+		"""
+
+		if os.path.exists(self.path):
+			if os.path.exists(self.flushing_path):
+				# Merge the new requests after the leftovers
+				with open(self.path, "r") as src, open(self.flushing_path, "a") as dst:
+					dst.write(src.read())
+				os.remove(self.path)
+			else:
+				os.rename(self.path, self.flushing_path)
+
+		if not os.path.exists(self.flushing_path):
+			return []
+
+		entries = []
+		with open(self.flushing_path, "r") as f:
+			for line in f:
+				line = line.strip()
+				if not line:
+					continue
+
+				try:
+					entries.append(json.loads(line))
+				except ValueError:
+					# A torn line can only be the last one
+					logger.warning("Ignoring malformed queue entry \"%s\"", line)
+
+		return entries
+
+	def done(self):
+		"""
+		Marks the taken entries as processed.
+		"""
+
+		if os.path.exists(self.flushing_path):
+			os.remove(self.flushing_path)
+
+	@staticmethod
+	def reduce(entries, database):
+		"""
+		Reduces the given entries to the net operation of every
+		diversion.
+
+		Only the last requested operation of a diversion matters. If it
+		matches the current diversion state (e.g. an unapply followed by
+		an apply of an applied diversion) the pair cancels out and the
+		diversion is dropped altogether, as long as the filesystem still
+		is as the last operation left it. Otherwise (e.g. RPM installed a
+		new version of a diverted file) both operations are kept.
+
+		:param: entries: the entries, as returned by take()
+		:param: database: the Database() to resolve the entries against
+		:returns: a list of (operation, diversion, create_directory) tuples
+		"""
+
+		net = {}
+
+		for entry in entries:
+			for name, diversion in database.find(package=entry["package"], source=entry["source"]):
+				key = (name, diversion.source)
+
+				# Move to the end, so that the execution order follows
+				# the last request
+				operations, _, _ = net.pop(key, ((), None, None))
+				net[key] = (
+					operations + (entry["operation"],),
+					diversion,
+					entry.get("create_directory", False)
+				)
+
+		reduced = []
+
+		for operations, diversion, create_directory in net.values():
+			operation = operations[-1]
+
+			if diversion.applied != (operation == "apply") or diversion.kind == DiversionKind.PATTERN:
+				# Patterns are always applied, to pick up new matches
+				reduced.append((operation, diversion, create_directory))
+			elif len(set(operations)) > 1 and diversion.drifted(database.root, database.backend):
+				opposite = "unapply" if operation == "apply" else "apply"
+
+				reduced.append((opposite, diversion, create_directory))
+				reduced.append((operation, diversion, create_directory))
+
+		return reduced
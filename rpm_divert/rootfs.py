@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# rpm-divert
+# Copyright (C) 2018 Eugenio "g7" Paolantonio
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of the <organization> nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Helpers to operate on an alternate root filesystem (e.g. a mounted image
+tree) without chroot()ing into it.
+
+Paths are resolved as the kernel would do inside a chroot: symlinks are
+followed relative to the root, and neither ".." nor absolute symlink
+targets can escape it.
+"""
+
+import errno
+
+import os
+
+__all__ = [
+	"resolve"
+]
+
+# Same as the kernel's limit
+MAX_SYMLINKS = 40
+
+def resolve(root, path, follow=True, backend=None):
+	"""
+	Resolves a path inside the given root.
+
+	:param: root: the root directory. If None or "/", path is returned
+	as-is.
+	:param: path: the absolute path, as seen from inside the root
+	:param: follow: if False, the last component is not followed when
+	it is a symlink (like lstat()). Defaults to True.
+	:param: backend: the filesystem backend to inspect symlinks with.
+	Defaults to None (the host filesystem).
+	:returns: the path on the host filesystem
+	"""
+
+	if root is None or os.path.abspath(root) == "/":
+		return path
+
+	root = os.path.abspath(root)
+
+	islink = backend.islink if backend is not None else os.path.islink
+	readlink = backend.readlink if backend is not None else os.readlink
+
+	components = [x for x in path.split("/") if x]
+	resolved = []
+	symlinks = 0
+
+	while components:
+		component = components.pop(0)
+
+		if component == ".":
+			continue
+		elif component == "..":
+			# Clamped at the root
+			if resolved:
+				resolved.pop()
+			continue
+
+		host_path = os.path.join(root, *resolved, component)
+
+		if (components or follow) and islink(host_path):
+			symlinks += 1
+			if symlinks > MAX_SYMLINKS:
+				raise OSError(errno.ELOOP, os.strerror(errno.ELOOP), path)
+
+			target = readlink(host_path)
+			if target.startswith("/"):
+				resolved = []
+
+			components = [x for x in target.split("/") if x] + components
+		else:
+			resolved.append(component)
+
+	return os.path.join(root, *resolved)
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+#
+# rpm-divert
+# Copyright (C) 2018 Eugenio "g7" Paolantonio
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of the <organization> nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Static shell scripts, for systems where Python isn't available (or is too
+slow to start), like an initramfs or a minimal container.
+
+export_script() compiles the diversions into a self-contained POSIX sh
+script doing the same safety checks and steps as Diversion.apply() and
+Diversion.unapply(). Without a database to look the applied state up in,
+the script tells it from the filesystem: a diversion whose diversion path
+exists is applied. It can thus be run again and again (e.g. on every
+boot), diversions already in the requested state are skipped. The script appends the outcome of every diversion to
+a status file, as tab-separated lines:
+
+	applied	custom-hello	/usr/bin/hello
+	unapplied	custom-hello	/usr/bin/hello
+
+which import_status() reads back to update the database.
+"""
+
+import logging
+
+import shlex
+
+from rpm_divert.diversion import DiversionKind
+
+__all__ = [
+	"export_script",
+	"import_status"
+]
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATUS_PATH = "/var/lib/rpm-divert/diversions.status"
+
+HEADER = r"""#!/bin/sh
+#
+# Generated by rpm-divert export-script from %(database)s.
+# Don't edit, export it again after changing the diversions.
+#
+# usage: [ROOT=DIR] [STATUS=FILE] sh <script> apply|unapply
+#
+# ROOT is the root filesystem to operate on, STATUS the file the outcome of
+# every diversion is appended to (defaults to $ROOT%(status)s),
+# to be imported with 'rpm-divert.py import-status'.
+
+set -u
+
+ROOT=${ROOT:-}
+STATUS=${STATUS:-$ROOT%(status)s}
+
+exists() {
+	[ -e "$1" ] || [ -L "$1" ]
+}
+
+realdir() {
+	[ -d "$1" ] && [ ! -L "$1" ]
+}
+
+remove() {
+	if realdir "$1"; then
+		rm -rf -- "$1"
+	else
+		rm -f -- "$1"
+	fi
+}
+
+perms() {
+	printf '%%s\n' "$1" | cut -c "$2-$3" | sed 's/s/xs/;s/S/s/;s/t/xt/;s/T/t/;s/-//g'
+}
+
+copymode() {
+	mode=$(ls -dnL -- "$1") || return 1
+	mode=${mode%%%% *}
+	chmod "u=$(perms "$mode" 2 4),g=$(perms "$mode" 5 7),o=$(perms "$mode" 8 10)" "$2"
+}
+
+status() {
+	printf '%%s\t%%s\t%%s\n' "$1" "$2" "$3" >> "$STATUS"
+}
+
+fail() {
+	echo "rpm-divert: $*" >&2
+	exit 1
+}
+
+# apply_one PACKAGE SOURCE DIVERSION ACTION REPLACEMENT KIND CREATE_DIRECTORY
+apply_one() {
+	src=$ROOT$2
+	div=$ROOT$3
+	rep=$ROOT$5
+	divdir=$(dirname -- "$div")
+
+	if exists "$div" && { [ "$4" = nothing ] || exists "$src"; }; then
+		# Already applied
+		status applied "$1" "$2"
+		return
+	fi
+
+	echo "diverting \"$src\" to \"$div\"" >&2
+
+	if [ "$7" = 1 ] && [ ! -e "$divdir" ]; then
+		mkdir -p -- "$divdir" || fail "unable to create $divdir"
+	fi
+
+	exists "$src" && ! exists "$div" && [ -d "$divdir" ] && \
+		{ [ "$6" != directory ] || realdir "$src"; } || \
+		fail "unable to apply diversion of $2, safety checks failed"
+
+	mv -- "$src" "$div" || fail "unable to apply diversion of $2"
+
+	case $4 in
+		symlink)
+			ln -s -- "$5" "$src" && copymode "$div" "$rep"
+			;;
+		copy)
+			if [ "$6" = directory ]; then
+				cp -R -P -p -- "$rep" "$src"
+			else
+				cp -p -- "$rep" "$src"
+			fi
+			;;
+	esac || fail "unable to apply diversion of $2"
+
+	status applied "$1" "$2"
+}
+
+# unapply_one PACKAGE SOURCE DIVERSION ACTION
+unapply_one() {
+	src=$ROOT$2
+	div=$ROOT$3
+
+	if ! exists "$div"; then
+		# Already unapplied
+		status unapplied "$1" "$2"
+		return
+	fi
+
+	echo "restoring diversion \"$src\" to \"$div\"" >&2
+
+	# RPM installs the new files before running the triggers, see
+	# Diversion.unapply()
+	if [ "$4" = nothing ] && exists "$src" && exists "$div"; then
+		echo "Diversion source already exists, removing old diversion and marking as unapplied" >&2
+		remove "$div" || fail "unable to unapply diversion of $2"
+		status unapplied "$1" "$2"
+		return
+	fi
+
+	if [ "$4" = nothing ]; then
+		! exists "$src"
+	else
+		exists "$src"
+	fi || \
+		fail "unable to unapply diversion of $2, safety checks failed"
+
+	if [ "$4" != nothing ]; then
+		remove "$src" || fail "unable to unapply diversion of $2"
+	fi
+
+	mv -- "$div" "$src" || fail "unable to unapply diversion of $2"
+
+	status unapplied "$1" "$2"
+}
+
+mkdir -p -- "$(dirname -- "$STATUS")" || fail "unable to create the status file directory"
+
+case ${1:-} in
+"""
+
+FOOTER = r"""	*)
+		echo "usage: [ROOT=DIR] [STATUS=FILE] sh $0 apply|unapply" >&2
+		exit 2
+		;;
+esac
+"""
+
+def _call(function, name, diversion, *extra):
+	"""
+	:param: function: the shell function to call
+	:param: name: the package name
+	:param: diversion: the Diversion() object
+	:param: extra: further arguments
+	:returns: the shell line calling function for the diversion
+	"""
+
+	return "\t\t%s %s\n" % (
+		function,
+		" ".join(
+			shlex.quote(str(argument))
+			for argument in (
+				name,
+				diversion.source,
+				diversion.diversion,
+				diversion.action,
+				diversion.replacement or "",
+				diversion.kind
+			) + extra
+		)
+	)
+
+def export_script(database, package=None, source=None, create_directory=False, status_path=DEFAULT_STATUS_PATH):
+	"""
+	Compiles diversions into a shell script.
+
+	Both "apply" and "unapply" process every diversion, skipping the
+	ones already in the requested state. Pattern diversions are
+	expanded at apply time and can't be exported.
+
+	:param: database: the Database() to export
+	:param: package: if not None, limits the export to the given package
+	:param: source: if not None, limits the export to the given source
+	:param: create_directory: if True, the script creates the directory
+	tree of the diversions that don't have one
+	:param: status_path: the default status file, inside the root
+	:returns: the script, as a string
+	"""
+
+	diversions = []
+	for name, diversion in sorted(database.find(package=package, source=source), key=lambda x: (x[0], x[1].source)):
+		if diversion.kind == DiversionKind.PATTERN:
+			logger.warning("skipping pattern diversion %s, it can't be exported", diversion)
+			continue
+
+		diversions.append((name, diversion))
+
+	script = [
+		HEADER % {
+			"database" : database.path,
+			"status" : status_path
+		},
+		"\tapply)\n"
+	]
+
+	for name, diversion in diversions:
+		script.append(_call("apply_one", name, diversion, 1 if create_directory else 0))
+
+	script.append("\t\t;;\n\tunapply)\n")
+
+	# Reverse order, as nested diversions must be undone first
+	for name, diversion in reversed(diversions):
+		script.append(_call("unapply_one", name, diversion))
+
+	script.append("\t\t;;\n")
+	script.append(FOOTER)
+
+	return "".join(script)
+
+def import_status(database, lines):
+	"""
+	Updates the applied state of the diversions from the lines of a
+	status file written by an exported script. The last line about a
+	diversion wins.
+
+	:param: database: the Database() to update
+	:param: lines: an iterable of status lines
+	:returns: the number of updated diversions
+	"""
+
+	states = {}
+
+	for line in lines:
+		line = line.rstrip("\n")
+		if not line:
+			continue
+
+		try:
+			state, name, source = line.split("\t")
+		except ValueError:
+			raise Exception("Invalid status line %r" % line)
+
+		if not state in ("applied", "unapplied"):
+			raise Exception("Unknown state %s" % state)
+
+		states[(name, source)] = (state == "applied")
+
+	for (name, source), applied in states.items():
+		found = database.find(package=name, source=source)
+		if not found:
+			logger.warning("diversion of %s by %s doesn't exist anymore, skipping", source, name)
+			continue
+
+		for name, diversion in found:
+			diversion.applied = applied
+			diversion.fingerprint = diversion.stat_fingerprint(database.root, database.backend)
+
+	return len(states)
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+#
+# rpm-divert
+# Copyright (C) 2018 Eugenio "g7" Paolantonio
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of the <organization> nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+The state stamp lets apply and unapply requests that would change nothing
+(most trigger invocations) exit right away, without loading the database.
+
+Every save writes, next to the database, the requests known to be no-ops
+in the saved state, with a fingerprint of the paths they depend on:
+
+	{
+		"format": 1,
+		"generation": [inode, mtime, size],
+		"requests": {
+			"[\"apply\", \"custom-hello\", null]": [["/usr/bin/hello", inode, mtime, size], ...]
+		}
+	}
+
+A request is still a no-op as long as the database file is the one the
+stamp has been written for (its generation), no operation is waiting in
+the journal, and none of the paths changed.
+
+This module only depends on the standard library, so that rpm-divert.py
+can load it without importing the rest of the package.
+"""
+
+import json
+
+import os
+
+__all__ = [
+	"request_key",
+	"write_stamp",
+	"read_stamp",
+	"nothing_to_do"
+]
+
+STAMP_FORMAT = 1
+
+# The same as Database's
+DEFAULT_DATABASE_PATH = "/var/lib/rpm-divert/diversions"
+
+def request_key(operation, package=None, source=None):
+	"""
+	:param: operation: "apply" or "unapply"
+	:param: package: the requested package, or None
+	:param: source: the requested source, or None
+	:returns: the key of the request in the stamp
+	"""
+
+	return json.dumps([operation, package, source])
+
+def _generation(path):
+	"""
+	:param: path: the database path
+	:returns: the generation of the database file
+	"""
+
+	st = os.stat(path)
+
+	return [st.st_ino, st.st_mtime_ns, st.st_size]
+
+def _fingerprint(paths):
+	"""
+	:param: paths: the host paths to fingerprint
+	:returns: a list of [path, inode, mtime, size] lists, without
+	following symlinks ([path] for missing paths)
+	"""
+
+	fingerprint = []
+
+	for path in paths:
+		try:
+			st = os.lstat(path)
+		except FileNotFoundError:
+			fingerprint.append([path])
+		else:
+			fingerprint.append([path, st.st_ino, st.st_mtime_ns, st.st_size])
+
+	return fingerprint
+
+def write_stamp(path, requests):
+	"""
+	Writes the stamp of a database, which must have just been saved.
+	The stamp is only a cache, so it is not fsync'd.
+
+	:param: path: the database path
+	:param: requests: a dictionary of request key -> list of the host
+	paths the request depends on
+	"""
+
+	temporary_path = "%s.stamp.new" % path
+
+	with open(temporary_path, "w") as f:
+		json.dump(
+			{
+				"format" : STAMP_FORMAT,
+				"generation" : _generation(path),
+				"requests" : {
+					key : _fingerprint(paths)
+					for key, paths in requests.items()
+				}
+			},
+			f
+		)
+
+	os.replace(temporary_path, "%s.stamp" % path)
+
+def read_stamp(path):
+	"""
+	Reads the stamp of a database, if it is still valid.
+
+	:param: path: the database path
+	:returns: a dictionary of request key -> fingerprint, empty if
+	the stamp is missing or stale.
+	"""
+
+	try:
+		with open("%s.stamp" % path, "r") as f:
+			stamp = json.load(f)
+
+		if stamp["format"] != STAMP_FORMAT or stamp["generation"] != _generation(path):
+			return {}
+
+		return stamp["requests"]
+	except (OSError, ValueError, KeyError, TypeError):
+		return {}
+
+def _database_path(root):
+	"""
+	:param: root: the root directory, or None
+	:returns: the host path of the default database, or None if it
+	can't be told without resolving symlinks inside the root
+	"""
+
+	if root is None or os.path.abspath(root) == "/":
+		return DEFAULT_DATABASE_PATH
+
+	path = os.path.abspath(root)
+	for component in DEFAULT_DATABASE_PATH.strip("/").split("/"):
+		path = os.path.join(path, component)
+
+		if os.path.islink(path):
+			return None
+
+	return path
+
+def nothing_to_do(argv):
+	"""
+	Checks whether a command line is an apply or unapply request that
+	would change nothing.
+
+	Only the plain forms are recognised:
+
+		[--root ROOT] apply|unapply [--package PACKAGE] [--source SOURCE]
+
+	:param: argv: the command line arguments
+	:returns: True if the request is a no-op, False if it has to run.
+	"""
+
+	arguments = list(argv)
+	root = package = source = None
+
+	if arguments[:1] == ["--root"] and len(arguments) > 1:
+		root = arguments[1]
+		del arguments[:2]
+
+	if not arguments or not arguments[0] in ("apply", "unapply"):
+		return False
+
+	operation = arguments.pop(0)
+
+	while arguments:
+		option = arguments.pop(0)
+
+		if option in ("--package", "-p") and arguments:
+			package = arguments.pop(0)
+		elif option in ("--source", "-s") and arguments:
+			source = arguments.pop(0)
+		else:
+			return False
+
+	path = _database_path(root)
+	if path is None or os.path.exists("%s.journal" % path):
+		return False
+
+	fingerprint = read_stamp(path).get(request_key(operation, package, source))
+
+	return fingerprint is not None and fingerprint == _fingerprint(x[0] for x in fingerprint)
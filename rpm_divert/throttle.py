@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+# rpm-divert
+# Copyright (C) 2018 Eugenio "g7" Paolantonio
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of the <organization> nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+I/O controls, to run apply on busy hosts without starving the production
+workload.
+"""
+
+import ctypes
+
+import logging
+
+import os
+
+import platform
+
+import time
+
+__all__ = [
+	"Throttle",
+	"set_idle_priority"
+]
+
+logger = logging.getLogger(__name__)
+
+# ioprio_set() isn't wrapped by the C library
+SYS_IOPRIO_SET = {
+	"x86_64" : 251,
+	"i386" : 289,
+	"i686" : 289,
+	"aarch64" : 30,
+	"riscv64" : 30,
+	"armv7l" : 314,
+	"ppc64le" : 273,
+	"s390x" : 282
+}
+
+# From linux/ioprio.h
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+
+class Throttle:
+
+	"""
+	Paces the filesystem steps, and keeps track of the throughput.
+
+	Both limits are enforced on average since the start: a step that
+	goes over the budget sleeps until the budget allows it.
+	"""
+
+	def __init__(self, max_bytes_per_sec=None, max_ops_per_sec=None):
+		"""
+		Initialises the class.
+
+		:param: max_bytes_per_sec: the maximum number of bytes copied
+		per second, or None for no limit
+		:param: max_ops_per_sec: the maximum number of other steps
+		(renames, symlinks, removals...) per second, or None for no
+		limit
+		"""
+
+		self.max_bytes_per_sec = max_bytes_per_sec
+		self.max_ops_per_sec = max_ops_per_sec
+
+		self.bytes = 0
+		self.operations = 0
+		self.waited = 0
+		self.started = time.monotonic()
+
+	def _wait(self, done, rate):
+		"""
+		Sleeps until the amount done fits the rate.
+
+		:param: done: the amount done so far
+		:param: rate: the maximum amount per second, or None
+		"""
+
+		if not rate:
+			return
+
+		delay = self.started + done / rate - time.monotonic()
+
+		if delay > 0:
+			self.waited += delay
+			time.sleep(delay)
+
+	def operation(self):
+		"""
+		Accounts for a step, waiting if needed before it runs.
+		"""
+
+		self._wait(self.operations, self.max_ops_per_sec)
+		self.operations += 1
+
+	def transfer(self, size):
+		"""
+		Accounts for copied data, waiting if needed.
+
+		:param: size: the number of bytes just copied
+		"""
+
+		self.bytes += size
+		self._wait(self.bytes, self.max_bytes_per_sec)
+
+	def report(self):
+		"""
+		:returns: a string describing the achieved throughput
+		"""
+
+		elapsed = max(time.monotonic() - self.started, 1e-6)
+
+		return "%d steps and %.1f MiB copied in %.2fs (%.1f steps/s, %.1f MiB/s, %.2fs throttled)" % (
+			self.operations,
+			self.bytes / 1024 / 1024,
+			elapsed,
+			self.operations / elapsed,
+			self.bytes / 1024 / 1024 / elapsed,
+			self.waited
+		)
+
+def set_idle_priority():
+	"""
+	Moves the current process to the idle I/O scheduling class, so that
+	it only gets disk time when nobody else needs it. If ioprio_set()
+	isn't available, the CPU priority is lowered instead.
+
+	:returns: True if the idle I/O class has been set, False if only the
+	CPU priority has been lowered.
+	"""
+
+	number = SYS_IOPRIO_SET.get(platform.machine())
+
+	if number is not None:
+		libc = ctypes.CDLL(None, use_errno=True)
+
+		if libc.syscall(number, IOPRIO_WHO_PROCESS, 0, IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) == 0:
+			return True
+
+		logger.debug("ioprio_set() failed: %s", os.strerror(ctypes.get_errno()))
+
+	os.setpriority(os.PRIO_PROCESS, 0, 19)
+
+	return False
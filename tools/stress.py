@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# rpm-divert
+# Copyright (C) 2018 Eugenio "g7" Paolantonio
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of the <organization> nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Concurrency stress harness.
+
+Runs several workers at the same time, each one invoking rpm-divert.py
+over and over with a random mix of add, remove, apply, unapply and list
+on its own package, against a single database in a scratch root (on
+tmpfs when available).
+
+Afterwards it checks that:
+ - the database is valid JSON;
+ - no successful add has been lost, and no successful remove undone;
+ - the applied flags match the filesystem.
+
+and reports the throughput and latency percentiles of every operation.
+"""
+
+import argparse
+
+import json
+
+import os
+
+import random
+
+import shutil
+
+import subprocess
+
+import sys
+
+import tempfile
+
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+RPM_DIVERT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "rpm-divert.py")
+
+DATABASE_PATH = "var/lib/rpm-divert/diversions"
+
+OPERATIONS = {
+	"add" : 30,
+	"remove" : 15,
+	"apply" : 20,
+	"unapply" : 20,
+	"list" : 15
+}
+
+def run(root, *args):
+	"""
+	Runs rpm-divert.py on the given root.
+
+	:param: root: the root directory
+	:param: args: the command arguments
+	:returns: a (success, duration) tuple
+	"""
+
+	start = time.monotonic()
+	process = subprocess.run(
+		[sys.executable, RPM_DIVERT, "--root", root] + [str(x) for x in args],
+		stdout=subprocess.DEVNULL,
+		stderr=subprocess.DEVNULL
+	)
+
+	return process.returncode == 0, time.monotonic() - start
+
+def worker(root, index, operations, seed):
+	"""
+	A single worker.
+
+	:param: root: the root directory
+	:param: index: the worker index
+	:param: operations: the number of operations to run
+	:param: seed: the random seed
+	:returns: a dictionary containing the expected diversions, and the
+	latencies of each operation
+	"""
+
+	rand = random.Random(seed + index)
+	package = "stress-%d" % index
+	directory = "/srv/w%d" % index
+	os.makedirs(os.path.join(root, directory.lstrip("/")))
+
+	expected = set()
+	latencies = {x : [] for x in OPERATIONS}
+	counter = 0
+
+	for _ in range(operations):
+		operation = rand.choices(list(OPERATIONS), weights=list(OPERATIONS.values()))[0]
+
+		if operation == "add":
+			counter += 1
+			source = "%s/f%d" % (directory, counter)
+			with open(os.path.join(root, source.lstrip("/")), "w") as f:
+				f.write(source)
+
+			success, duration = run(root, "add", package, source, source + ".diverted")
+			if success:
+				expected.add(source)
+		elif operation == "remove":
+			if not expected:
+				continue
+
+			source = rand.choice(sorted(expected))
+			# Fails if the diversion is applied, which is fine
+			success, duration = run(root, "remove", package, source)
+			if success:
+				expected.discard(source)
+		elif operation in ("apply", "unapply"):
+			success, duration = run(root, operation, "-p", package)
+		else:
+			success, duration = run(root, "list")
+
+		latencies[operation].append(duration)
+
+	return {
+		"package" : package,
+		"expected" : expected,
+		"latencies" : latencies
+	}
+
+def check(root, results):
+	"""
+	Checks the invariants.
+
+	:param: root: the root directory
+	:param: results: the worker results
+	:returns: the list of violations
+	"""
+
+	violations = []
+
+	try:
+		with open(os.path.join(root, DATABASE_PATH), "r") as f:
+			database = json.load(f)
+	except (OSError, ValueError) as e:
+		return ["database is not valid JSON: %s" % e]
+
+	packages = {
+		pkg["package"] : {
+			diversion["source"] : diversion
+			for diversion in pkg["diversions"]
+		}
+		for pkg in database
+	}
+
+	for result in results:
+		actual = packages.get(result["package"], {})
+
+		for source in sorted(result["expected"] - set(actual)):
+			violations.append("lost add of %s" % source)
+		for source in sorted(set(actual) - result["expected"]):
+			violations.append("lost remove of %s" % source)
+
+		for source, diversion in actual.items():
+			source_exists = os.path.lexists(os.path.join(root, source.lstrip("/")))
+			diversion_exists = os.path.lexists(os.path.join(root, diversion["diversion"].lstrip("/")))
+
+			if (source_exists, diversion_exists) != ((False, True) if diversion["applied"] else (True, False)):
+				violations.append(
+					"%s is %s, but source %s and diversion %s" % (
+						source,
+						"applied" if diversion["applied"] else "not applied",
+						"exists" if source_exists else "is missing",
+						"exists" if diversion_exists else "is missing"
+					)
+				)
+
+	return violations
+
+def percentile(values, fraction):
+	"""
+	:param: values: a sorted list
+	:param: fraction: the percentile, between 0 and 1
+	:returns: the value at the given percentile
+	"""
+
+	return values[min(len(values) - 1, int(len(values) * fraction))]
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+	parser.add_argument("--workers", "-w", type=int, default=8, help="the number of concurrent workers")
+	parser.add_argument("--operations", "-n", type=int, default=50, help="the number of operations per worker")
+	parser.add_argument("--seed", type=int, default=0, help="the random seed")
+	parser.add_argument("--keep", action="store_true", help="keep the scratch root")
+	args = parser.parse_args()
+
+	root = tempfile.mkdtemp(
+		prefix="rpm-divert-stress-",
+		dir="/dev/shm" if os.path.isdir("/dev/shm") else None
+	)
+
+	try:
+		start = time.monotonic()
+		with ThreadPoolExecutor(max_workers=args.workers) as executor:
+			results = list(
+				executor.map(
+					lambda index: worker(root, index, args.operations, args.seed),
+					range(args.workers)
+				)
+			)
+		elapsed = time.monotonic() - start
+
+		total = 0
+		print("%-10s %8s %10s %10s %10s %10s" % ("operation", "count", "p50 (ms)", "p90 (ms)", "p99 (ms)", "max (ms)"))
+		for operation in OPERATIONS:
+			latencies = sorted(
+				duration
+				for result in results
+				for duration in result["latencies"][operation]
+			)
+			total += len(latencies)
+
+			if not latencies:
+				continue
+
+			print(
+				"%-10s %8d %10.1f %10.1f %10.1f %10.1f" % (
+					operation,
+					len(latencies),
+					percentile(latencies, 0.5) * 1000,
+					percentile(latencies, 0.9) * 1000,
+					percentile(latencies, 0.99) * 1000,
+					latencies[-1] * 1000
+				)
+			)
+
+		print("%d operations by %d workers in %.2fs (%.1f ops/s)" % (total, args.workers, elapsed, total / elapsed))
+
+		violations = check(root, results)
+		for violation in violations:
+			print("VIOLATION: %s" % violation)
+
+		if violations:
+			print("%d invariant violations" % len(violations))
+			sys.exit(1)
+
+		print("all invariants hold")
+	finally:
+		if args.keep:
+			print("scratch root kept in %s" % root)
+		else:
+			shutil.rmtree(root)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# rpm-divert
+# Copyright (C) 2018 Eugenio "g7" Paolantonio
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#    * Neither the name of the <organization> nor the
+#      names of its contributors may be used to endorse or promote products
+#      derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+RPM upgrade scenario benchmark.
+
+Builds a synthetic root in a scratch directory, with N packages owning M
+diverted files each, and then upgrades every package the way RPM does,
+without needing rpm: a stand-in first installs the new payload over the
+diverted paths, and then fires the package triggers, which run
+`rpm-divert.py unapply -p PACKAGE` and `rpm-divert.py apply -p PACKAGE`
+(see Diversion.unapply()).
+
+Afterwards it checks that every diversion is applied and holds the new
+payload, and reports the total wall time, the time per trigger and how
+much of it is just process startup.
+"""
+
+import argparse
+
+import os
+
+import shutil
+
+import subprocess
+
+import sys
+
+import tempfile
+
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from rpm_divert import Database
+
+RPM_DIVERT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "rpm-divert.py")
+
+def run(root, *args):
+	"""
+	Runs rpm-divert.py on the given root.
+
+	:param: root: the root directory
+	:param: args: the command arguments
+	:returns: the duration
+	"""
+
+	start = time.monotonic()
+	subprocess.run(
+		[sys.executable, RPM_DIVERT, "--root", root] + [str(x) for x in args],
+		stdout=subprocess.DEVNULL,
+		stderr=subprocess.DEVNULL,
+		check=True
+	)
+
+	return time.monotonic() - start
+
+def payload(package, count):
+	"""
+	:param: package: the package name
+	:param: count: the number of diverted files
+	:returns: the list of the package's diverted files
+	"""
+
+	return [
+		"/usr/lib/%s/file%d" % (package, index)
+		for index in range(count)
+	]
+
+def install(root, files, version):
+	"""
+	The rpm stand-in: installs a payload, replacing whatever is in place.
+
+	:param: root: the root directory
+	:param: files: the files to install
+	:param: version: the package version, written in every file
+	"""
+
+	for path in files:
+		host_path = os.path.join(root, path.lstrip("/"))
+		os.makedirs(os.path.dirname(host_path), exist_ok=True)
+
+		temporary_path = "%s;%s" % (host_path, version)
+		with open(temporary_path, "w") as f:
+			f.write("%s %s\n" % (path, version))
+		os.replace(temporary_path, host_path)
+
+def setup(root, packages, diversions):
+	"""
+	Installs version 1 of every package and applies its diversions.
+
+	:param: root: the root directory
+	:param: packages: the package names
+	:param: diversions: the number of diversions per package
+	"""
+
+	with Database.open(mode="rw", root=root) as database:
+		for package in packages:
+			files = payload(package, diversions)
+			install(root, files, 1)
+
+			for path in files:
+				database.add(package, path, path + ".distrib")
+
+		database.apply()
+
+def check(root, packages, diversions, version):
+	"""
+	Checks that every diversion is applied and holds the given version.
+
+	:param: root: the root directory
+	:param: packages: the package names
+	:param: diversions: the number of diversions per package
+	:param: version: the expected version
+	:returns: the list of problems
+	"""
+
+	problems = []
+
+	with Database.open(mode="r", root=root, cache=False) as database:
+		for package in packages:
+			for path in payload(package, diversions):
+				diverted = os.path.join(root, path.lstrip("/") + ".distrib")
+
+				if not all(diversion.applied for name, diversion in database.find(package, path)):
+					problems.append("%s is not applied" % path)
+				elif not os.path.exists(diverted):
+					problems.append("%s is missing" % diverted)
+				else:
+					with open(diverted, "r") as f:
+						if f.read() != "%s %s\n" % (path, version):
+							problems.append("%s doesn't hold version %s" % (diverted, version))
+
+	return problems
+
+def stats(durations):
+	"""
+	:param: durations: a list of durations
+	:returns: a string with the mean, median and max durations, in ms
+	"""
+
+	durations = sorted(durations)
+
+	return "mean %7.1f ms  p50 %7.1f ms  max %7.1f ms" % (
+		sum(durations) / len(durations) * 1000,
+		durations[len(durations) // 2] * 1000,
+		durations[-1] * 1000
+	)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+	parser.add_argument("--packages", "-n", type=int, default=20, help="the number of packages")
+	parser.add_argument("--diversions", "-m", type=int, default=10, help="the number of diversions per package")
+	parser.add_argument("--upgrades", "-u", type=int, default=1, help="the number of upgrade transactions")
+	parser.add_argument("--keep", action="store_true", help="keep the scratch root")
+	args = parser.parse_args()
+
+	root = tempfile.mkdtemp(prefix="rpm-divert-upgrade-")
+	packages = ["bench-%d" % index for index in range(args.packages)]
+
+	try:
+		start = time.monotonic()
+		setup(root, packages, args.diversions)
+		print("setup: %d packages, %d diversions in %.2fs" % (len(packages), len(packages) * args.diversions, time.monotonic() - start))
+
+		# Process startup alone, and a trigger that does nothing
+		spawn = []
+		noop = []
+		for _ in range(10):
+			started = time.monotonic()
+			subprocess.run([sys.executable, "-c", ""], check=True)
+			spawn.append(time.monotonic() - started)
+			noop.append(run(root, "apply", "-p", "no-such-package"))
+
+		triggers = {"unapply" : [], "apply" : []}
+		install_time = 0
+
+		start = time.monotonic()
+		for version in range(2, args.upgrades + 2):
+			for package in packages:
+				started = time.monotonic()
+				install(root, payload(package, args.diversions), version)
+				install_time += time.monotonic() - started
+
+				for trigger in ("unapply", "apply"):
+					triggers[trigger].append(run(root, trigger, "-p", package))
+		elapsed = time.monotonic() - start
+
+		count = sum(len(durations) for durations in triggers.values())
+		trigger_time = sum(sum(durations) for durations in triggers.values())
+		overhead = sum(noop) / len(noop)
+
+		print("python startup   %s" % stats(spawn))
+		print("no-op trigger    %s" % stats(noop))
+		for trigger, durations in triggers.items():
+			print("%-16s %s" % (trigger, stats(durations)))
+		print(
+			"%d upgrades of %d packages in %.2fs: %.2fs installing, %.2fs in %d triggers, %.0f%% of which is process startup and database load" % (
+				args.upgrades,
+				len(packages),
+				elapsed,
+				install_time,
+				trigger_time,
+				count,
+				min(100, overhead * count / trigger_time * 100)
+			)
+		)
+
+		problems = check(root, packages, args.diversions, args.upgrades + 1)
+		for problem in problems:
+			print("PROBLEM: %s" % problem)
+
+		if problems:
+			sys.exit(1)
+	finally:
+		if args.keep:
+			print("scratch root kept in %s" % root)
+		else:
+			shutil.rmtree(root)